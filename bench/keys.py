@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Replay key sequence against fake screen and count what was drawn.
+Compares handling every key separately (how dnev worked before) with
+coalescing of queued motion keys (how it works now):
+
+    python bench/keys.py                # 300 j, 120 k, few opens, 300 j again
+    python bench/keys.py recorded.keys  # file with keys as typed, one char per key
+
+Fake screen makes every draw call cost as much as `--draw-cost` microseconds,
+roughly what ncurses spends on terminal output over ssh.
+"""
+
+import argparse
+import curses
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dnevnichok.core import DirItem     # noqa: E402
+from dnevnichok.events import event_hub  # noqa: E402
+from dnevnichok.ui import ItemList      # noqa: E402
+
+
+class FakeScreen:
+    """ Just enough of curses window for ItemList. Keys are taken from `keys` """
+    def __init__(self, keys, lines=40, cols=100, draw_cost=0):
+        self.keys = list(reversed(keys))
+        self.lines, self.cols = lines, cols
+        self.draw_cost = draw_cost / 1000000
+        self.draws = self.refreshes = 0
+        self._nodelay = False
+
+    def _draw(self):
+        if self.draw_cost:
+            time.sleep(self.draw_cost)
+
+    def getmaxyx(self): return self.lines, self.cols
+    def clear(self): self.draws += 1
+    def nodelay(self, flag): self._nodelay = flag
+
+    def addstr(self, *args):
+        self.draws += 1
+        self._draw()
+
+    def refresh(self):
+        self.refreshes += 1
+        self._draw()
+
+    def noutrefresh(self): pass
+
+    def doupdate(self):
+        self.refreshes += 1
+        self._draw()
+
+    def get_wch(self):
+        if not self.keys:
+            raise curses.error('no input')
+        return self.keys.pop()
+
+    def unget_wch(self, c):
+        self.keys.append(c)
+
+
+def patch_curses(scr):
+    """ Functions of curses module which need real terminal """
+    curses.color_pair = lambda n: 0
+    curses.beep = lambda: None
+    curses.doupdate = scr.doupdate
+    curses.ungetch = curses.unget_wch = scr.unget_wch
+
+
+def replay(keys, items, coalesce, draw_cost) -> dict:
+    scr = FakeScreen(keys, draw_cost=draw_cost)
+    patch_curses(scr)
+    event_hub.__init__()
+    pane = ItemList(scr, items)
+    pane.render()
+    event_hub.register('key-press', pane.process_keypress)
+    event_hub.register('open', lambda item: None)
+    scr.draws = scr.refreshes = 0
+
+    started = time.perf_counter()
+    while scr.keys:
+        c = scr.get_wch()
+        shift = pane.read_motion(c) if coalesce else None
+        if shift is None:
+            event_hub.trigger(('key-press', c))
+        else:
+            pane.move(shift)
+    return {'time': time.perf_counter() - started, 'draws': scr.draws,
+            'refreshes': scr.refreshes, 'position': (pane._items.page, pane.cur_item)}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('keys', nargs='?', help='file with recorded keys')
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--draw-cost', type=int, default=50, help='microseconds per draw call')
+    args = parser.parse_args()
+
+    if args.keys:
+        with open(args.keys, encoding='utf-8') as f:
+            keys = list(f.read().replace('\n', ''))
+    else:
+        keys = list('j' * 300 + 'k' * 120 + 'l' + 'j' * 5 + 'l' + 'j' * 300)
+    items = [DirItem(i, {'title': 'item {}'.format(i), 'size': i}) for i in range(args.items)]
+
+    print('{} keys, {} items'.format(len(keys), len(items)))
+    results = {}
+    for name, coalesce in (('every key', False), ('coalesced', True)):
+        results[name] = replay(keys, items, coalesce, args.draw_cost)
+        print('{:>10}: {time:.3f}s, {draws} draws, {refreshes} refreshes, '
+              'page {position[0]} item {position[1]}'.format(name, **results[name]))
+    if results['every key']['position'] != results['coalesced']['position']:
+        print('Final positions differ!')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
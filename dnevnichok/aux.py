@@ -35,3 +35,55 @@ class PagedItems(UserList):
 
     def has_prev(self):
         return self.page > 1
+
+
+class KeysetPagedItems(PagedItems):
+    """ Same interface as PagedItems, but pages are loaded lazily with
+    fetch(after, limit) -> (items, last_key). Only rows up to the current page
+    (plus one to know about the next one) are ever fetched.
+    """
+    def __init__(self, fetch, lines=50, start_page=1):
+        self._fetch = fetch
+        self._after = None
+        self._exhausted = False
+        self._lines = lines
+        self._full_data = []
+        self._unpaged = False
+        self.data = []
+        self.set_page(start_page)
+
+    def _load(self, count):
+        while not self._exhausted and len(self._full_data) < count:
+            limit = max(self._lines, count - len(self._full_data))
+            items, self._after = self._fetch(self._after, limit)
+            self._full_data.extend(items)
+            if len(items) < limit:
+                self._exhausted = True
+
+    def set_page(self, page):
+        self._load(page*self._lines + 1)
+        super().set_page(page)
+
+
+class LazyPagedItems(PagedItems):
+    """ Same interface as PagedItems over any sequence of rows, but items are
+    made with make_item(row) only for current page
+    """
+    def __init__(self, rows, make_item, lines=50, start_page=1):
+        self._make_item = make_item
+        self._lines = lines
+        self._full_data = rows
+        self._unpaged = False
+        self.data = []
+        self.set_page(start_page)
+
+    def set_page(self, page):
+        self.page = page
+        rows = self._full_data[(self.page-1)*self._lines:self.page*self._lines]
+        self.data = [self._make_item(row) for row in rows]
+
+
+def find_nodes(doctree, node_class):
+    """ Iterate over nodes of class in docutils doctree """
+    find = getattr(doctree, 'findall', doctree.traverse)     # traverse is deprecated in docutils 0.18
+    return find(node_class)
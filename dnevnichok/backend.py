@@ -2,6 +2,7 @@ import logging
 from os.path import join
 import subprocess
 
+from dnevnichok.client import DaemonError
 from dnevnichok.config import Config
 
 logger = logging.getLogger(__name__)
@@ -20,6 +21,7 @@ class GitCommandBackend:
             self.path = path if path else config.get_path('notes')
             self.notes_status = dict()
             self.repo_status = set()
+            self.daemon = None      # DaemonClient, if statuses are cached by daemon
 
     def get_file_mod_date(self, file_path):
         command = 'git log -1 --format="%ad" --date=iso -- ' + join(self.path, file_path)
@@ -33,6 +35,67 @@ class GitCommandBackend:
         date = proc.stdout.read()
         return date.decode('UTF-8').strip()
 
+    def get_blob_hashes(self) -> dict:
+        """ {'./path': blob sha} of every file in git index with a single call.
+        Doesn't know about changes in working tree """
+        command = ['git', '--git-dir=' + join(self.path, '.git'), '--work-tree=' + self.path,
+                   'ls-files', '--stage', '-z']
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=self.path)
+        hashes = {}
+        for entry in proc.stdout.read().split(b'\0'):
+            if not entry:
+                continue
+            info, path = entry.split(b'\t', 1)
+            mode, sha, stage = info.split()
+            hashes['./' + path.decode('UTF-8')] = sha.decode()
+        proc.wait()
+        return hashes
+
+    def git(self, *args) -> list:
+        return ['git', '--git-dir=' + join(self.path, '.git'), '--work-tree=' + self.path,
+                '-c', 'core.quotepath=off'] + list(args)
+
+    def get_head(self):
+        """ SHA of HEAD or None in repo without commits """
+        proc = subprocess.Popen(self.git('rev-parse', '--verify', '-q', 'HEAD'),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=self.path)
+        head = proc.stdout.read().decode().strip()
+        return head if proc.wait() == 0 and head else None
+
+    def is_ancestor(self, commit, descendant) -> bool:
+        return subprocess.call(self.git('merge-base', '--is-ancestor', commit, descendant),
+                               stderr=subprocess.DEVNULL, cwd=self.path) == 0
+
+    def walk_history(self, since=None):
+        """ Yield (sha, epoch, author, subject, [(status, path), ...]) of every commit
+        from the oldest one (or the one after `since`) to HEAD, with a single git log """
+        revs = since + '..HEAD' if since else 'HEAD'
+        command = self.git('log', '--reverse', '--no-renames', '--name-status',
+                           '--format=%x1e%H%x1f%at%x1f%an%x1f%s', revs, '--')
+        proc = subprocess.Popen(command, stdout=subprocess.PIPE, cwd=self.path)
+        commit = None
+        for line in proc.stdout:
+            line = line.decode('UTF-8', 'replace').rstrip('\n')
+            if line.startswith('\x1e'):
+                if commit:
+                    yield commit
+                sha, epoch, author, subject = line[1:].split('\x1f', 3)
+                commit = (sha, int(epoch), author, subject, [])
+            elif line and commit:
+                status, path = line.split('\t', 1)
+                commit[4].append((status, path))
+        if commit:
+            yield commit
+        proc.wait()
+
+    def show_file(self, commit, path) -> bytes:
+        """ Content of file at path (relative to repo) in commit """
+        proc = subprocess.Popen(self.git('show', '{}:{}'.format(commit, path)),
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, cwd=self.path)
+        content = proc.stdout.read()
+        proc.wait()
+        return content
+
     def update_repo_status(self):
         statuses = set(self.notes_status.values())
         stat = set()
@@ -54,7 +117,29 @@ class GitCommandBackend:
         subprocess.Popen(command, stdout=subprocess.PIPE, shell=True)
         self.update_statuses()
 
+    def add_paths(self, paths) -> bool:
+        """ git add of many paths with a single call, they are passed through stdin.
+        Statuses aren't updated, call update_statuses after the last batch """
+        proc = subprocess.Popen(self.git('add', '--pathspec-from-file=-', '--pathspec-file-nul'),
+                                stdin=subprocess.PIPE, cwd=self.path)
+        proc.communicate(b'\0'.join(path.encode('UTF-8') for path in paths))
+        return proc.returncode == 0
+
+    def drop_daemon(self, error):
+        """ Daemon failed or went away, work in-process from now on """
+        logger.warning("Working without daemon: " + error.message)
+        self.daemon = None
+
     def update_statuses(self):
+        if self.daemon:
+            try:
+                status = self.daemon.status()
+            except DaemonError as e:
+                self.drop_daemon(e)
+            else:
+                self.notes_status = status['notes']
+                self.repo_status = set(status['repo'])
+                return
         command = 'git --git-dir={} --work-tree={} status --short'.format(
             join(self.path, '.git'), self.path
         )
@@ -0,0 +1,194 @@
+"""
+Headless access to the index for scripts and cron jobs:
+
+    dnev query --tag work --sort name
+    dnev query --tags 'work & !archived' --search meeting
+    dnev daemon
+    dnev export --jobs 4
+    dnev maintain --vacuum
+    dnev import ~/old-docs --dest docs --git-add
+    dnev -n work query --search meeting
+    dnev query --notebooks --search meeting
+
+Notes are printed as newline-delimited JSON while they are read from DB.
+If daemon is running, query is sent to it, otherwise it is run in-process.
+Neither curses nor docutils are imported here (unless DB has to be populated),
+so a call takes tens of milliseconds.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from dnevnichok.client import DaemonError, DaemonUnavailable, connect
+from dnevnichok.config import config, setup_logging
+
+logger = logging.getLogger(__name__)
+
+QUERY_MANAGERS = ('all', 'favorites', 'modified')  # others need state, given by --tag, --dir etc.
+
+
+def write_items(items, out):
+    for item in items:
+        out.write(json.dumps(item, ensure_ascii=False) + '\n')
+    out.flush()
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(prog='dnev')
+    parser.add_argument('-n', '--notebook', help='work in this notebook (default is the one from [Paths])')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='log memory report of populate, managers and search')
+    commands = parser.add_subparsers(dest='command')
+    query = commands.add_parser('query', help='print notes as newline-delimited JSON')
+    source = query.add_mutually_exclusive_group()
+    source.add_argument('--manager', default='all', choices=QUERY_MANAGERS,
+                        help='all, favorites, modified (default is all)')
+    source.add_argument('--tag', help='notes with this tag')
+    source.add_argument('--month', help='notes published in month, e.g. 2014-05')
+    source.add_argument('--period', help='notes published in 2014, 2014-W19, 2014-05-12 '
+                                         'or range like 2014-01-01..2014-03-15')
+    source.add_argument('--dir', help='notes in directory, relative to notebook')
+    source.add_argument('--tags', help="boolean tag query, e.g. 'work & !archived | meeting'")
+    query.add_argument('--search', help='only notes with this text in title, filename or content')
+    query.add_argument('--sort', default='date', help='date, name or size (default is date)')
+    query.add_argument('--limit', type=int, help='print at most this many notes')
+    query.add_argument('--notebooks', action='store_true',
+                       help='notes of all notebooks by date, only --search and --limit apply')
+    commands.add_parser('daemon', help='serve index to other dnev instances')
+    export = commands.add_parser('export', help='render notes and index pages to HTML')
+    export.add_argument('--out', help='output dir (default is export in [Paths])')
+    export.add_argument('--jobs', type=int, help='number of rendering processes (default is number of CPUs)')
+    export.add_argument('--force', action='store_true', help='render all notes, not only changed')
+    maintain = commands.add_parser('maintain', help='clean up and optimize DB, print report')
+    maintain.add_argument('--vacuum', action='store_true', help='give free pages back to file system')
+    commands.add_parser('index', help='populate DB or upgrade it to current version')
+    import_ = commands.add_parser('import', help='copy tree of .rst files into notebook and index it')
+    import_.add_argument('source', help='dir to import, interrupted import of it is resumed')
+    import_.add_argument('--dest', help='dir in notebook (default is named as source)')
+    import_.add_argument('--batch', type=int, default=200, help='files per transaction (default is 200)')
+    import_.add_argument('--git-add', action='store_true', help='git add imported files, one call per batch')
+    return parser
+
+
+def ensure_populated():
+    """ Populate DB if there's none, upgrade it if it's older than dnevnichok """
+    from dnevnichok.schema import ensure_schema
+    ensure_schema()
+
+
+def query_in_process(args):
+    from dnevnichok.managers import ManagerHub
+    from dnevnichok.query import item_to_dict, query_items
+
+    os.chdir(config.get_path('notes'))
+    manager_hub = ManagerHub()
+    ensure_populated()
+    return (item_to_dict(item) for item in query_items(manager_hub, args))
+
+
+def query_notebooks(args):
+    from dnevnichok.notebooks import read_notebooks
+    from dnevnichok.query import QueryError, item_to_dict
+
+    if args.tag or args.month or args.period or args.dir or args.tags or args.manager != 'all' \
+            or args.sort != 'date':
+        raise QueryError("Only --search and --limit work with --notebooks")
+    return (item_to_dict(item) for item in read_notebooks(args.search, args.limit))
+
+
+def export(args) -> int:
+    from dnevnichok.export import export_notes
+
+    os.chdir(config.get_path('notes'))
+    ensure_populated()
+    stats = export_notes(args.out, args.jobs, args.force)
+    sys.stderr.write('{rendered} rendered, {skipped} unchanged, {removed} removed, '
+                     '{failed} failed\n'.format(**stats))
+    return 1 if stats['failed'] else 0
+
+
+def import_(args) -> int:
+    from dnevnichok.importer import ImporterError, import_tree
+
+    source = os.path.abspath(args.source)   # relative to where dnev is called
+    os.chdir(config.get_path('notes'))
+    ensure_populated()
+    try:
+        stats = import_tree(source, args.dest, args.batch, args.git_add)
+    except ImporterError as e:
+        sys.stderr.write(e.message + '\n')
+        return 1
+    sys.stderr.write('{imported} imported, {skipped} already indexed, {conflicts} conflicting, '
+                     '{failed} failed\n'.format(**stats))
+    return 1 if stats['failed'] or stats['conflicts'] else 0
+
+
+def main(argv=None) -> int:
+    argv = argv if argv is not None else sys.argv[1:]
+    parser = get_parser()
+    args = parser.parse_args(argv)
+    if args.notebook:
+        try:
+            config.use_notebook(args.notebook)
+        except KeyError:
+            sys.stderr.write("Unknown notebook: {}\n".format(args.notebook))
+            return 2
+    if args.profile_memory:
+        os.environ['DNEV_PROFILE_MEMORY'] = '1'     # for indexing subprocesses too
+    setup_logging()
+
+    if args.command is None:
+        return None     # only options like `dnev -n NAME`, so curses UI is run
+    elif args.command == 'daemon':
+        from dnevnichok.daemon import serve
+        return serve()
+    elif args.command == 'export':
+        return export(args)
+    elif args.command == 'maintain':
+        from dnevnichok.maintain import maintain
+        os.chdir(config.get_path('notes'))
+        ensure_populated()
+        for line in maintain(args.vacuum):
+            sys.stdout.write(line + '\n')
+        return 0
+    elif args.command == 'import':
+        return import_(args)
+    elif args.command == 'index':
+        os.chdir(config.get_path('notes'))
+        ensure_populated()
+        return 0
+    elif args.command != 'query':
+        parser.print_usage(sys.stderr)
+        return 2
+
+    daemon = None if args.notebooks else connect()    # daemon serves only its notebook
+    try:
+        items = None
+        if daemon:
+            try:
+                items = daemon.query(argv[argv.index('query') + 1:])
+            except DaemonUnavailable as e:   # went away after ping, nothing is printed yet
+                logger.warning(e.message)
+        if items is not None:
+            write_items(items, sys.stdout)
+        else:
+            from dnevnichok.query import QueryError
+            try:
+                items = query_notebooks(args) if args.notebooks else query_in_process(args)
+                write_items(items, sys.stdout)
+            except QueryError as e:
+                sys.stderr.write(e.message + '\n')
+                return 1
+    except DaemonError as e:
+        sys.stderr.write(e.message + '\n')
+        return 1
+    except BrokenPipeError:     # e.g. piped to head
+        sys.stderr.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
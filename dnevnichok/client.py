@@ -0,0 +1,89 @@
+"""
+Client for index daemon (see dnevnichok.daemon).
+Kept light: it is imported by headless CLI before anything else.
+"""
+
+import json
+import logging
+import socket
+
+from dnevnichok.config import config
+
+logger = logging.getLogger(__name__)
+
+
+class DaemonError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+class DaemonUnavailable(DaemonError):
+    """ Daemon can't be reached or went away, callers fall back to in-process work """
+
+
+class DaemonClient:
+    """ One connection per request. Request is a JSON line, response is a
+    stream of JSON lines finished by {"end": true} or {"error": ...}
+    """
+    def __init__(self, path=None):
+        self.path = path if path else config.get_path('socket')
+
+    def request(self, command: str, **args):
+        """ Send request right away and return generator of response messages
+        as they arrive. Raise DaemonUnavailable if daemon can't be reached """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.path)
+            sock.sendall(json.dumps({'command': command, 'args': args}).encode() + b'\n')
+        except OSError as e:
+            sock.close()
+            raise DaemonUnavailable("Can't reach daemon at {}: {}".format(self.path, e)) from e
+        return self.read_response(sock)
+
+    def read_response(self, sock):
+        try:
+            with sock.makefile('r', encoding='utf-8') as response:
+                for line in response:
+                    message = json.loads(line)
+                    if 'error' in message:
+                        raise DaemonError(message['error'])
+                    if message.get('end'):
+                        return
+                    yield message
+        except OSError as e:
+            raise DaemonUnavailable("Lost connection to daemon: {}".format(e)) from e
+        finally:
+            sock.close()
+        raise DaemonUnavailable("Daemon closed connection")
+
+    def call(self, command: str, **args):
+        """ Request with single response """
+        for message in self.request(command, **args):
+            return message
+
+    def ping(self) -> bool:
+        return self.call('ping') == {'pong': True}
+
+    def query(self, argv: list):
+        return self.request('query', argv=argv)
+
+    def status(self) -> dict:
+        return self.call('status')
+
+    def index(self, path: str):
+        return self.call('index', path=path)
+
+    def repopulate(self):
+        return self.call('repopulate')
+
+
+def connect(path=None):
+    """ Return client if daemon is running or None """
+    client = DaemonClient(path)
+    try:
+        client.ping()
+    except DaemonError as e:
+        logger.debug("No daemon at {}: {}".format(client.path, e))
+        return None
+    logger.info("Connected to daemon at " + client.path)
+    return client
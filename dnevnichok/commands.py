@@ -1,23 +1,28 @@
 import curses
 import os
 import sys
-import sqlite3
 import subprocess
 import inspect
 import logging
 
 from dnevnichok.backend import GitCommandBackend
+from dnevnichok.client import DaemonError
 from dnevnichok.config import Config
-from dnevnichok.core import NoteItem, TagItem
+from dnevnichok.core import NoteItem, ShardNoteItem, TagItem, period_bounds
+from dnevnichok.db import get_connection
 from dnevnichok.events import event_hub
-from dnevnichok.populate import parse_note
+from dnevnichok.populate import insert_note, parse_note
+from dnevnichok.snapshot import refresh_snapshot
+from dnevnichok.tagquery import TagQueryError
 
 
 config = Config()
 git = GitCommandBackend()
-dbpath = config.get_path('db')
 logger = logging.getLogger(__name__)
 
+# Notes of cross-notebook view have ids of their own shards and live in other repos
+READ_ONLY = 'Notes of other notebooks are read-only here, open them with dnev -n NOTEBOOK'
+
 
 class InsufficientArguments(Exception):
     def __init__(self, args):
@@ -83,16 +88,21 @@ class updateCommand(Command):
 class deleteCommand(Command):
     def __init__(self, executor, args):
         self.executor = executor
-        self.conn = sqlite3.connect(dbpath)
+        self.conn = get_connection()
         self.item = self.executor.app.window.get_current_item()
 
     def ensure(self):
+        if isinstance(self.item, ShardNoteItem):
+            return True     # refused in run, nothing to confirm
         return self.executor.ensure('Are you sure you want to delete {}? [y/N] '.format(self.item.get_path()),
                                     default=False)
 
     def run(self):
         table = None
-        if isinstance(self.item, NoteItem):
+        if isinstance(self.item, ShardNoteItem):
+            event_hub.trigger(('print', READ_ONLY))
+            return
+        elif isinstance(self.item, NoteItem):
             exit_code = os.system('rm ' + self.item.get_path())
             if exit_code == 0:
                 table = 'notes'
@@ -102,7 +112,9 @@ class deleteCommand(Command):
         if table:
             with self.conn:
                 cur = self.conn.cursor()
-                cur.execute('DELETE FROM {} WHERE id = {}'.format(table, self.item.id))
+                cur.execute('DELETE FROM {} WHERE id = ?'.format(table), (self.item.id,))
+            refresh_snapshot(background=True)
+            event_hub.trigger(('tags-changed', self.item.id if table == 'notes' else None))
             event_hub.trigger(('reload',))
             curses.curs_set(1)  # THIS is sought-for hack
             curses.curs_set(0)
@@ -123,7 +135,7 @@ class commitCommand(Command):
 class newCommand(Command):
     def __init__(self, executor, args: tuple):
         self.executor = executor
-        self.conn = sqlite3.connect(dbpath)
+        self.conn = get_connection()
         self.path = None
         self.content = ''
 
@@ -148,22 +160,158 @@ class newCommand(Command):
         exit_code = os.system('vim ' + note_path)
         if exit_code == 0:
             git.add(note_path)
-            note = parse_note(note_path, dir_id)
-            with self.conn:
-                cur = self.conn.cursor()
-                cur.execute("""INSERT INTO notes(title, real_title, full_path, pub_date, mod_date, size, dir_id, favorite)
-                               VALUES(?, ?, ?, ?, ?, ?, ?, ?)""",
-                            (note.get_title(), note.real_title, note.path, note.pub_date, note.mod_date, note.get_size(), note.dir_id, note.favorite))
-                note.id = cur.lastrowid
-                for tag in note.tags:
-                    cur.execute("INSERT OR IGNORE INTO tags(title) VALUES(?)", (tag,))
-                    cur.execute("INSERT INTO note_tags(note_id, tag_id) VALUES(?, ?)", (note.id, cur.lastrowid,))
+            if git.daemon:
+                try:
+                    note_id = git.daemon.index(note_path)['id']
+                except DaemonError as e:
+                    git.drop_daemon(e)
+            if not git.daemon:
+                note = parse_note(note_path, dir_id)
+                with self.conn:
+                    insert_note(self.conn.cursor(), note)
+                note_id = note.id
+                refresh_snapshot(background=True)
+            event_hub.trigger(('tags-changed', note_id))
 
         event_hub.trigger(('reload',))
         curses.curs_set(1)  # THIS is sought-for hack
         curses.curs_set(0)
 
 
+class queryCommand(Command):
+    """ Show notes matching boolean tag query: `query work & !archived | meeting` """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        if not args:
+            raise InsufficientArguments(1)
+        self.query = ' '.join(args)
+
+    def run(self):
+        manager_hub = self.executor.app.manager_hub
+        try:
+            manager_hub.manager_names['tagquery'].set_query(self.query)
+        except TagQueryError as e:
+            event_hub.trigger(('print', e.message))
+            return
+        manager_hub.switch_by_name('tagquery')
+
+
+class notebooksCommand(Command):
+    """ Notes of all notebooks by date: `notebooks`, or `notebooks meeting` to search in them """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        self.query = ' '.join(args)
+
+    def run(self):
+        manager_hub = self.executor.app.manager_hub
+        manager_hub.manager_names['notebooks'].set_query(self.query)
+        manager_hub.switch_by_name('notebooks')
+
+
+class calendarCommand(Command):
+    """ Notes by day, week or year: `calendar day` """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        if not args:
+            raise InsufficientArguments(1)
+        self.scale = args[0]
+
+    def run(self):
+        manager_hub = self.executor.app.manager_hub
+        calendar = manager_hub.manager_names['calendar']
+        if self.scale not in calendar.scales:
+            event_hub.trigger(('print', 'Scale is one of: ' + ', '.join(sorted(calendar.scales))))
+            return
+        calendar.set_scale(self.scale)
+        manager_hub.switch_by_name('calendar')
+
+
+class rangeCommand(Command):
+    """ Notes published between two days, both inclusive: `range 2014-01-01 2014-03-15`.
+    Year (2014), month (2014-01) and week (2014-W02) can be used as well
+    """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        if len(args) < 2:
+            raise InsufficientArguments(2)
+        self.period = '..'.join(args[:2])
+
+    def run(self):
+        try:
+            period_bounds(self.period)
+        except ValueError:
+            event_hub.trigger(('print', 'Dates must look like 2014, 2014-05, 2014-W19 or 2014-05-12'))
+            return
+        manager_hub = self.executor.app.manager_hub
+        manager_hub.manager_names['calendar'].chpath(self.period)
+        manager_hub.switch_by_name('calendar')
+
+
+class backlinksCommand(Command):
+    """ Show notes referencing highlighted one """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        self.item = self.executor.get_current_item()
+
+    def run(self):
+        if not isinstance(self.item, NoteItem):
+            event_hub.trigger(('print', 'Backlinks are shown only for notes'))
+            return
+        if isinstance(self.item, ShardNoteItem):
+            event_hub.trigger(('print', READ_ONLY))
+            return
+        manager_hub = self.executor.app.manager_hub
+        manager_hub.manager_names['backlinks'].set_target(self.item.full_path)
+        manager_hub.switch_by_name('backlinks')
+
+
+class historyCommand(Command):
+    """ Show commits touching highlighted note """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        self.item = self.executor.get_current_item()
+
+    def run(self):
+        if not isinstance(self.item, NoteItem):
+            event_hub.trigger(('print', 'History is shown only for notes'))
+            return
+        if isinstance(self.item, ShardNoteItem):
+            event_hub.trigger(('print', READ_ONLY))
+            return
+        manager_hub = self.executor.app.manager_hub
+        manager_hub.manager_names['history'].chpath(self.item.full_path)
+        manager_hub.switch_by_name('history')
+
+
+class maintainCommand(Command):
+    """ Clean up and optimize DB: `maintain` or `maintain vacuum`. Report goes to log """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        self.vacuum = bool(args) and args[0] == 'vacuum'
+
+    def run(self):
+        from dnevnichok.maintain import maintain
+        event_hub.trigger(('print', 'Maintaining DB...'))
+        report = maintain(self.vacuum)
+        event_hub.trigger(('tags-changed',))
+        event_hub.trigger(('reload',))
+        event_hub.trigger(('print', report[-1] + ', see log for report'))
+
+
+class exportCommand(Command):
+    """ Render notebook to HTML: `export` or `export force` to render all notes """
+    def __init__(self, executor, args: tuple):
+        self.executor = executor
+        self.force = bool(args) and args[0] == 'force'
+
+    def run(self):
+        from dnevnichok.export import export_notes
+        event_hub.trigger(('print', 'Exporting...'))
+        stats = export_notes(force=self.force)
+        event_hub.trigger(('print', 'Export: {rendered} rendered, {skipped} unchanged, '
+                                    '{removed} removed, {failed} failed'.format(**stats)))
+
+
 def get_all_commands() -> dict:
     """Returns all classes from this module which ends with `Command`"""
     commands = {}
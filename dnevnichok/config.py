@@ -3,6 +3,9 @@ import logging.config
 from os import getenv, makedirs
 from os.path import abspath, dirname, exists, expanduser, join, realpath
 
+MAIN_NOTEBOOK = 'main'          # name of notebook from [Paths], unless it's set there
+NOTEBOOK_SECTION = 'Notebook {}'
+
 
 def setup_logging():
     logging.config.dictConfig({
@@ -50,25 +53,67 @@ class Config:
     Responsible for getting configuration from specific path or communicate with
     user to init it with user or default values.
     Implements Borg pattern
+    Besides notebook from [Paths] there may be others, every one in its own
+    section with its own notes and DB::
+
+        [Notebook work]
+        notes = ~/work/notes
+
+    All paths except log are of current notebook, chosen by use_notebook
+    or $DNEV_NOTEBOOK
     """
     __shared_state = {}
 
     def __init__(self, configpath=None):
         self.__dict__ = self.__shared_state
+        if not hasattr(self, 'notebook'):
+            self.notebook = None    # None is the one from [Paths]
         self.config = configparser.ConfigParser()
         self.default_paths = {
-            'log':   lambda: abspath(expanduser('~/.dnevnichok.log')),
-            'notes': lambda: abspath(expanduser('~/notebook')),
-            'db':    lambda: join(self.get_path('notes'), '.dnevnichok.db')
+            'log':   lambda get: abspath(expanduser('~/.dnevnichok.log')),
+            'notes': lambda get: abspath(expanduser('~/notebook')),
+            'db':    lambda get: join(get('notes'), '.dnevnichok.db'),
+            'socket': lambda get: get('db') + '.sock',
+            'snapshot': lambda get: get('db') + '.snap',
+            'parse_cache': lambda get: get('db') + '.cache',
+            'history': lambda get: get('db') + '.history',
+            'export': lambda get: join(get('notes'), '_html'),
         }
         self.configpath = configpath if configpath else self.get_configpath()
         if not exists(self.configpath):
             self.initial_config()
         else:
             self.config.read(self.configpath)
-
-    def get_path(self, path):
-        path = self.config.get('Paths', path, fallback=self.default_paths[path]())
+        if self.notebook is None and getenv('DNEV_NOTEBOOK'):
+            self.use_notebook(getenv('DNEV_NOTEBOOK'))
+
+    def get_section(self, notebook=None) -> str:
+        notebook = notebook if notebook else self.notebook
+        if notebook is None or notebook == self.get_main_notebook():
+            return 'Paths'
+        return NOTEBOOK_SECTION.format(notebook)
+
+    def get_main_notebook(self) -> str:
+        return self.config.get('Paths', 'name', fallback=MAIN_NOTEBOOK)
+
+    def get_notebooks(self) -> list:
+        """ Names of all notebooks, the one from [Paths] first """
+        prefix = NOTEBOOK_SECTION.format('')
+        return [self.get_main_notebook()] + [section[len(prefix):] for section in self.config.sections()
+                                             if section.startswith(prefix)]
+
+    def use_notebook(self, notebook: str):
+        """ Make paths point to other notebook. Must be called before
+        anything reads them, i.e. before import of populate or managers """
+        if notebook not in self.get_notebooks():
+            raise KeyError(notebook)
+        self.notebook = notebook
+
+    def get_path(self, path, notebook=None):
+        """ Path of current notebook or of given one """
+        section = 'Paths' if path == 'log' else self.get_section(notebook)
+        get = lambda path: self.get_path(path, notebook)
+        path = self.config.get(section, path, fallback=self.default_paths[path](get))
         return abspath(expanduser(path))
 
     def get_configpath(self):
@@ -118,5 +163,9 @@ class Config:
         """ Fallback method """
         return self.config.get(section, option, fallback=fallback)
 
+    def getboolean(self, section, option, fallback: bool) -> bool:
+        """ yes/no, on/off, true/false or 1/0 """
+        return self.config.getboolean(section, option, fallback=fallback)
+
 
 config = Config()
@@ -0,0 +1,100 @@
+"""
+Bounded LRU cache of note contents, shared by search and preview.
+Every entry keeps decoded text and its lower-cased form (for case-insensitive
+search) and is checked against mtime and size of the file on every access,
+so stat is the only syscall for notes which didn't change.
+Safe to use from preview thread.
+"""
+
+from collections import OrderedDict
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 32   # MB
+
+
+class ContentCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size    # bytes
+        self.size = 0
+        self._entries = OrderedDict()   # path -> (mtime_ns, size, text, lower)
+        self._lock = threading.Lock()
+
+    def _valid(self, path: str):
+        """ Entry of path if file didn't change since it was read, otherwise None """
+        entry = self._entries.get(path)
+        if entry is None:
+            return None
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if stat is None or (stat.st_mtime_ns, stat.st_size) != entry[:2]:
+            self._drop(path)
+            return None
+        self._entries.move_to_end(path)
+        return entry
+
+    def _drop(self, path: str):
+        entry = self._entries.pop(path)
+        self.size -= entry[1] * 2
+
+    def _load(self, path: str):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            text = f.read().decode('UTF-8', 'replace')
+        entry = (stat.st_mtime_ns, stat.st_size, text, text.lower())
+        if stat.st_size * 2 <= self.max_size:   # too big notes aren't cached
+            if path in self._entries:
+                self._drop(path)
+            self._entries[path] = entry
+            self.size += stat.st_size * 2
+            while self.size > self.max_size:
+                self._drop(next(iter(self._entries)))
+        return entry
+
+    def peek(self, path: str):
+        """ Cached (text, lower) or None, never reads the file """
+        with self._lock:
+            entry = self._valid(path)
+        return entry[2:] if entry else None
+
+    def get(self, path: str) -> str:
+        with self._lock:
+            entry = self._valid(path) or self._load(path)
+        return entry[2]
+
+    def get_lower(self, path: str) -> str:
+        with self._lock:
+            entry = self._valid(path) or self._load(path)
+        return entry[3]
+
+    def warm(self, paths):
+        """ Read files which aren't cached yet while they fit into free room,
+        so nothing cached is evicted """
+        for path in paths:
+            with self._lock:
+                if self.size >= self.max_size:
+                    return
+                if path in self._entries:
+                    continue
+                try:
+                    if self.size + os.stat(path).st_size * 2 <= self.max_size:
+                        self._load(path)
+                except OSError as e:
+                    logger.warning(e)
+
+
+_cache = None
+
+
+def get_content_cache() -> ContentCache:
+    global _cache
+    if _cache is None:
+        from dnevnichok.config import config
+        max_size = int(config.get('Index', 'content_cache_size', DEFAULT_MAX_SIZE))
+        _cache = ContentCache(max_size * 1024 * 1024)
+    return _cache
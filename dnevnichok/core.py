@@ -1,8 +1,60 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 import logging
+import os
+
+from dnevnichok.contentcache import get_content_cache
 
 logger = logging.getLogger(__name__)
 
+GIT_DATE_FORMAT = '%Y-%m-%d %H:%M:%S %z'    # git log --date=iso
+DIARY_FORMAT = 'diary_%d-%m-%Y.rst'         # notes created by N
+
+
+def to_epoch(date: str) -> int:
+    """ Git date to UTC epoch, 0 if there is no date """
+    try:
+        return int(datetime.strptime(date, GIT_DATE_FORMAT).timestamp())
+    except (TypeError, ValueError):
+        return 0
+
+
+def from_epoch(epoch: int) -> str:
+    """ UTC epoch to git date in local timezone, '' for 0 """
+    if not epoch:
+        return ''
+    return datetime.fromtimestamp(epoch).astimezone().strftime(GIT_DATE_FORMAT)
+
+
+def diary_epoch(path: str):
+    """ Local midnight of diary note's day or None if it's not a diary note """
+    try:
+        return int(datetime.strptime(os.path.basename(path), DIARY_FORMAT).timestamp())
+    except ValueError:
+        return None
+
+
+def period_bounds(period: str) -> tuple:
+    """ [start, end) local epochs of period: '2014', '2014-05', '2014-W19',
+    '2014-05-12' or range of two of them 'A..B' (both inclusive) """
+    if '..' in period:
+        start, end = period.split('..', 1)
+        return period_bounds(start)[0], period_bounds(end)[1]
+    if '-W' in period:      # weeks are from Monday, as %W in SQLite
+        year = datetime.strptime(period[:4], '%Y')
+        next_year = year.replace(year=year.year+1)
+        start = datetime.strptime(period + '-1', '%Y-W%W-%w')
+        start, end = max(start, year), min(start + timedelta(days=7), next_year)
+    elif len(period) == 4:
+        start = datetime.strptime(period, '%Y')
+        end = start.replace(year=start.year+1)
+    elif len(period) == 7:
+        start = datetime.strptime(period, '%Y-%m')
+        end = (start + timedelta(days=31)).replace(day=1)
+    else:
+        start = datetime.strptime(period, '%Y-%m-%d')
+        end = start + timedelta(days=1)
+    return int(start.timestamp()), int(end.timestamp())
+
 
 class ItemInterface:
     """
@@ -30,7 +82,7 @@ class ItemInterface:
 
 
 class TagItem(ItemInterface):
-    columns = ('title', 'size',)
+    columns = ('title', 'size', 'latest_ts', 'favorites',)
 
     def __init__(self, item_id, kwargs=None):
         super().__init__(item_id, kwargs)
@@ -38,6 +90,14 @@ class TagItem(ItemInterface):
     def get_size(self):
         return self.size
 
+    def get_auxinfo(self):
+        info = []
+        if self.latest_ts:
+            info.append(datetime.fromtimestamp(self.latest_ts).strftime('last %d %b %y'))
+        if self.favorites:
+            info.append('{} favorite'.format(self.favorites))
+        return ', '.join(info)
+
     def get_path(self):
         return self.title
 
@@ -74,14 +134,13 @@ class NoteItem(ItemInterface):
             self.path = self.full_path       #TODO: set full_path everywhere!!!!11
             if not self.real_title and self.title.find('diary_') >= 0:      # too
                 try:
-                    self.title = datetime.strptime(self.title, 'diary_%d-%m-%Y.rst').strftime('Дневничок от %d %B %Y')
+                    self.title = datetime.strptime(self.title, DIARY_FORMAT).strftime('Дневничок от %d %B %Y')
                 except ValueError:
                     pass
 
     def get_content(self):
         try:
-            with open(self.full_path, 'rt') as f:
-                return f.read()
+            return get_content_cache().get(self.full_path)
         except FileNotFoundError as e:
             logger.warning(e)
             return ''
@@ -106,13 +165,13 @@ class NoteItem(ItemInterface):
 
     def get_mod_date(self):
         try:
-            date = datetime.strptime(self.mod_date, '%Y-%m-%d %H:%M:%S %z')
+            date = datetime.strptime(self.mod_date, GIT_DATE_FORMAT)
         except ValueError: return ''
         return date.strftime('%d %b %y')
 
     def get_pub_date(self):
         try:
-            date = datetime.strptime(self.pub_date, '%Y-%m-%d %H:%M:%S %z')
+            date = datetime.strptime(self.pub_date, GIT_DATE_FORMAT)
         except ValueError: return ''
         return date.strftime('%d %b %y')
 
@@ -125,6 +184,43 @@ class NoteItem(ItemInterface):
         return (self.title, self.status, self.get_mod_date(),)
 
 
+class ShardNoteItem(NoteItem):
+    """ Note of any notebook in cross-notebook view. full_path is absolute,
+    so the note is reachable from whatever notebook dnev works in """
+    columns = NoteItem.columns + ('pub_ts', 'notebook',)
+
+    def get_auxinfo(self):
+        return '{}: {}'.format(self.notebook, ', '.join(self.tags)) if self.tags else self.notebook
+
+    def __eq__(self, other):
+        return super().__eq__(other) and self.notebook == other.notebook
+
+
+class RevisionItem(ItemInterface):
+    """ Note as it was in some commit. Id is commit's id in history index """
+    columns = ('title', 'sha', 'ts', 'author', 'full_path', 'status',)
+
+    def __init__(self, item_id, kwargs=None):
+        super().__init__(item_id, kwargs)
+
+    def get_date(self):
+        return datetime.fromtimestamp(self.ts).strftime('%d %b %y %H:%M')
+
+    def get_path(self):
+        return self.full_path[2:] if self.full_path.startswith('./') else self.full_path
+
+    def get_auxinfo(self):
+        return '{} {}'.format(self.sha[:7], self.author)
+
+    def get_color(self):
+        return 4
+
+    def get_view(self):
+        """ View is tuple responsible to display item in ItemList """
+
+        return (self.title, self.status, self.get_date(),)
+
+
 class MonthItem(ItemInterface):
     columns = ('title', 'size',)
 
@@ -147,3 +243,39 @@ class MonthItem(ItemInterface):
         """ View is tuple responsible to display item in ItemList """
 
         return self.get_title(), '', self.get_size(), self.get_auxinfo(),
+
+
+class PeriodItem(ItemInterface):
+    """ Day, week, year or range of days. Id is the period itself, see period_bounds """
+    columns = ('title', 'size',)
+
+    def __init__(self, item_id, kwargs=None):
+        super().__init__(item_id, kwargs)
+        if not kwargs:
+            self.title = item_id
+
+    def get_title(self):
+        if '..' in self.title:
+            return ' — '.join(PeriodItem(p).get_title() for p in self.title.split('..', 1))
+        elif '-W' in self.title:
+            return 'Week {}, {}'.format(self.title[6:], self.title[:4])
+        elif len(self.title) == 4:
+            return self.title
+        elif len(self.title) == 7:
+            return datetime.strptime(self.title, '%Y-%m').strftime('%B %Y')
+        else:
+            return datetime.strptime(self.title, '%Y-%m-%d').strftime('%d %B %Y')
+
+    def get_size(self):
+        return self.size
+
+    def get_path(self):
+        return self.title
+
+    def get_color(self):
+        return 5
+
+    def get_view(self):
+        """ View is tuple responsible to display item in ItemList """
+
+        return self.get_title(), '', self.get_size(), self.get_auxinfo(),
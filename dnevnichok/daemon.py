@@ -0,0 +1,186 @@
+"""
+Resident index daemon: `dnev daemon`.
+Owns the index, git status cache and watching of notebook, and serves
+queries and updates to `dnev` instances over a Unix domain socket, so they
+don't run their own git status and repopulation.
+Every connection is served in its own thread, but the index is used by
+one request (or watching, done in the main thread between them) at a
+time: the whole response is built under lock and sent after it's
+released, so a client which reads slowly holds only its own thread.
+Threads have their own DB connections, which are closed with the request.
+"""
+
+import json
+import logging
+import os
+import signal
+import socketserver
+import sys
+import threading
+import time
+
+from dnevnichok.backend import GitCommandBackend
+from dnevnichok.cli import get_parser
+from dnevnichok.client import connect
+from dnevnichok.config import config
+from dnevnichok.db import close_connections
+from dnevnichok.events import event_hub
+from dnevnichok.managers import ManagerHub
+from dnevnichok.populate import reindex_note, repopulate_db
+from dnevnichok.query import QueryError, item_to_dict, query_items
+from dnevnichok.schema import ensure_schema
+from dnevnichok.snapshot import refresh_snapshot
+
+logger = logging.getLogger(__name__)
+
+WATCH_INTERVAL = 2      # seconds between checks of notebook
+STATUS_MAX_AGE = 0.5    # git status older than this is refreshed on request
+SEND_TIMEOUT = 10       # seconds, client which stops reading for longer is dropped
+
+
+class Index:
+    """ Everything daemon serves. Method do_<command> generates response messages """
+    def __init__(self):
+        self.manager_hub = ManagerHub()
+        self.backend = GitCommandBackend()
+        self._watched = {}      # path -> (status, mtime) of changed notes
+        self._last_watch = 0
+        self.watch()
+
+    def do_ping(self):
+        yield {'pong': True}
+
+    def do_query(self, argv):
+        try:
+            args = get_parser().parse_args(['query'] + argv)
+        except SystemExit:      # argparse already printed the reason
+            raise QueryError("Bad query arguments: " + ' '.join(argv))
+        for item in query_items(self.manager_hub, args):
+            yield item_to_dict(item)
+
+    def do_status(self):
+        if time.time() - self._last_watch > STATUS_MAX_AGE:
+            self.watch()
+        yield {'notes': self.backend.notes_status,
+               'repo': sorted(self.backend.repo_status)}
+
+    def do_index(self, path):
+        note_id = self.reindex(path)
+        refresh_snapshot()
+        yield {'id': note_id}
+
+    def do_repopulate(self):
+        repopulate_db()
+        self._watched = {}
+        event_hub.trigger(('tags-changed',))
+        yield {'repopulated': True}
+
+    def reindex(self, path):
+        """ Reparse note by path relative to notebook """
+        path = path if path.startswith('./') else './' + path
+        dir_id = self.manager_hub.get_path_id(os.path.dirname(path))
+        old_id, new_id = reindex_note(path, dir_id)
+        for note_id in (old_id, new_id):
+            if note_id is not None:
+                event_hub.trigger(('tags-changed', note_id))
+        logger.info("Reindexed {} ({} -> {})".format(path, old_id, new_id))
+        return new_id
+
+    def watch(self):
+        """ Refresh git status and reindex notes whose status or mtime changed.
+        Notes which just left status (e.g. commited) are reindexed too,
+        because their dates changed """
+        self._last_watch = time.time()
+        self.backend.update_statuses()
+        watched = {}
+        for path, status in self.backend.notes_status.items():
+            if not path.endswith('.rst'):
+                continue
+            try:
+                mtime = os.stat(path).st_mtime
+            except FileNotFoundError:
+                mtime = None
+            watched[path] = (status, mtime)
+        changed = [path for path in set(watched) | set(self._watched)
+                   if watched.get(path) != self._watched.get(path)]
+        for path in changed:
+            try:
+                self.reindex(path)
+            except Exception as e:     # broken note mustn't stop daemon
+                logger.warning("Can't reindex {}: {}".format(path, e))
+        self._watched = watched
+        if changed:     # once for all reindexed notes
+            refresh_snapshot()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    timeout = SEND_TIMEOUT
+
+    def handle(self):
+        try:
+            line = self.rfile.readline()
+        except OSError as e:    # connected, but didn't ask anything in time
+            logger.debug("Request not received: {}".format(e))
+            return
+        if not line:            # connected and left
+            return
+        try:
+            request = json.loads(line.decode())
+            messages = self.server.respond(request['command'], request.get('args', {}))
+            messages.append({'end': True})
+        except Exception as e:
+            logger.exception("Request failed")
+            messages = [{'error': getattr(e, 'message', str(e))}]
+
+        try:
+            for message in messages:
+                self.wfile.write(json.dumps(message, ensure_ascii=False).encode() + b'\n')
+        except OSError as e:    # client doesn't need the rest or stopped reading
+            logger.debug("Response not sent: {}".format(e))
+
+
+class DaemonServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True   # don't wait for stuck clients on exit
+
+    def __init__(self, path, index):
+        self.index = index
+        self.lock = threading.Lock()
+        super().__init__(path, RequestHandler)
+
+    def respond(self, command, args) -> list:
+        """ Response messages of index, built under lock """
+        handler = getattr(self.index, 'do_' + command)
+        with self.lock:
+            try:
+                return list(handler(**args))
+            finally:
+                close_connections()     # thread ends with request
+
+    def service_actions(self):
+        """ Called by serve_forever in the main thread between requests """
+        if time.time() - self.index._last_watch > WATCH_INTERVAL:
+            with self.lock:
+                self.index.watch()
+
+
+def serve(path=None):
+    path = path if path else config.get_path('socket')
+    if connect(path):
+        logger.error("Daemon is already running at " + path)
+        return 1
+    if os.path.exists(path):    # stale socket of died daemon
+        os.unlink(path)
+
+    os.chdir(config.get_path('notes'))
+    ensure_schema()
+    server = DaemonServer(path, Index())
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    logger.info("Serving index at " + path)
+    try:
+        server.serve_forever(poll_interval=0.5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+    return 0
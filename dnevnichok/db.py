@@ -0,0 +1,47 @@
+"""
+Connections to cache DB.
+Every thread has one shared connection per DB, so compiled statements are
+reused by everything in it. DB is in WAL mode, so other dnev instances and
+daemon can read while one of them writes.
+All queries must use bound parameters (?) instead of formatting values into
+SQL, otherwise statement cache is useless.
+"""
+
+import logging
+import sqlite3
+import threading
+
+from dnevnichok.config import config
+
+logger = logging.getLogger(__name__)
+
+STATEMENT_CACHE = 256   # per connection, default 128 is a bit small for all managers * sort modes
+
+_local = threading.local()
+
+
+def connect(dbpath) -> sqlite3.Connection:
+    """ New tuned connection. Prefer get_connection """
+    conn = sqlite3.connect(dbpath, cached_statements=STATEMENT_CACHE)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")     # durable enough for cache
+    return conn
+
+
+def get_connection(dbpath=None) -> sqlite3.Connection:
+    """ Shared connection of current thread """
+    dbpath = dbpath if dbpath else config.get_path('db')
+    if not hasattr(_local, 'connections'):
+        _local.connections = {}
+    if dbpath not in _local.connections:
+        logger.debug("Connecting to {}".format(dbpath))
+        _local.connections[dbpath] = connect(dbpath)
+    return _local.connections[dbpath]
+
+
+def close_connections():
+    """ Close connections of current thread """
+    for conn in getattr(_local, 'connections', {}).values():
+        conn.close()
+    _local.connections = {}
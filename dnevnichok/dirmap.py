@@ -0,0 +1,70 @@
+"""
+All directories of notebook in memory: full path <-> id and parent of every
+dir. Loaded from DB once and again only after it's invalidated: by
+'dirs-changed' event of repopulation and import, or by lookup of dir which
+isn't known (e.g. imported by other process). So lookups need no SQL.
+Paths look like in notes.full_path: '.' is root, './work/sub' is nested dir.
+"""
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ROOT = '.'
+
+
+def normalize(path: str) -> str:
+    """ 'work/sub/', './work//sub' and 'work/./sub' are all './work/sub' """
+    parts = [p for p in path.split('/') if p and p != '.']
+    return '/'.join([ROOT] + parts)
+
+
+class DirMap:
+    def __init__(self):
+        self._loaded = False
+        self.paths = []     # id -> path, None for missing ids
+        self.parents = []   # id -> id of parent, None for root
+        self.ids = {}       # path -> id
+
+    def invalidate(self):
+        """ Dirs were changed, next load reads them again """
+        self._loaded = False
+
+    def load(self, conn):
+        """ Build maps, unless they are loaded and weren't invalidated since """
+        if self._loaded:
+            return
+        titles = dict(conn.execute("SELECT id, title FROM dirs").fetchall())
+        size = max(titles, default=0) + 1
+        self.parents = [None] * size
+        for ancestor, descendant in conn.execute("""SELECT ancestor, descendant
+                                                    FROM dirs_path WHERE direct = 1"""):
+            self.parents[descendant] = ancestor
+
+        self.paths = [None] * size
+        for dir_id in titles:
+            self._resolve(dir_id, titles)
+        self.ids = {path: dir_id for dir_id, path in enumerate(self.paths) if path is not None}
+        self._loaded = True
+        logger.debug("Loaded {} dirs".format(len(self.ids)))
+
+    def _resolve(self, dir_id, titles) -> str:
+        """ Path of dir, parents are resolved first (iteratively, dirs may be deep) """
+        chain = []
+        while dir_id is not None and self.paths[dir_id] is None:
+            chain.append(dir_id)
+            dir_id = self.parents[dir_id]
+        path = self.paths[dir_id] if dir_id is not None else None
+        for dir_id in reversed(chain):
+            path = path + '/' + titles[dir_id] if path else ROOT
+            self.paths[dir_id] = path
+        return path
+
+    def get_path(self, dir_id: int):
+        return self.paths[dir_id] if 0 <= dir_id < len(self.paths) else None
+
+    def get_id(self, path: str):
+        return self.ids.get(normalize(path))
+
+    def get_parent(self, dir_id: int):
+        return self.parents[dir_id] if 0 <= dir_id < len(self.parents) else None
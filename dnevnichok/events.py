@@ -8,6 +8,8 @@ logger = logging.getLogger(__name__)
 # reload - get all items to manager and sequently fire `show items`
 # show - show passed items in window
 # print - print something to status bar
+# tags-changed - tags of note with passed id (or of all notes if nothing passed) were changed in DB
+# dirs-changed - dirs were added or renumbered in DB (repopulation, import)
 
 
 class EventHub:
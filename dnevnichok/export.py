@@ -0,0 +1,281 @@
+"""
+Render notebook to static HTML, e.g. to publish it or to feed Pelican/Sphinx theme.
+
+Every note becomes page next to its path in output dir (``export`` in ``[Paths]``),
+plus index pages for all notes, tags and months built from DB. Links to other
+notes are pointed to their pages. Output dir inside notebook gets .gitignore,
+so generated pages are never commited with notes.
+Rerun is incremental: manifest in output dir remembers stat and blob SHA of every
+exported source and hash of export settings, so only new or changed notes are
+rendered (in a pool of processes), deleted ones are removed.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import html
+import json
+import logging
+import os
+from os.path import dirname, exists, join, normpath, relpath, realpath
+from urllib.parse import urlsplit, urlunsplit
+
+from dnevnichok.aux import find_nodes
+from dnevnichok.config import config
+from dnevnichok.db import get_connection
+from dnevnichok.parsecache import blob_hash
+
+logger = logging.getLogger(__name__)
+
+VERSION = 3             # bump when rendering changes in a way settings don't show
+MANIFEST = '.manifest.json'
+POOL_THRESHOLD = 8      # starting processes costs more than rendering few notes
+
+DOCUTILS_SETTINGS = {
+    'halt_level': 5,            # render broken markup as is instead of failing
+    'report_level': 5,
+    'syntax_highlight': 'none',
+    'embed_stylesheet': False,
+    'doctitle_xform': True,
+}
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{title}</title>
+</head>
+<body>
+<nav><a href="{root}index.html">All notes</a></nav>
+{body}
+</body>
+</html>
+"""
+
+
+def settings_hash() -> str:
+    settings = json.dumps([VERSION, DOCUTILS_SETTINGS, PAGE], sort_keys=True)
+    return hashlib.sha1(settings.encode()).hexdigest()
+
+
+def html_path(full_path: str) -> str:
+    """ ./work/a.rst -> work/a.html """
+    return normpath(full_path)[:-len('.rst')] + '.html'
+
+
+def root_link(path: str) -> str:
+    """ Relative link to output dir from page at `path` """
+    depth = path.count('/')
+    return '../' * depth
+
+
+def rewrite_links(doctree, page_path: str):
+    """ Point references to .rst files of notebook (and :doc: ones) to their
+    pages. Paths starting with / are relative to notebook root, as in links.resolve """
+    from docutils import nodes
+
+    for node in find_nodes(doctree, nodes.reference):
+        url = urlsplit(node['refdoc'] + '.rst' if 'refdoc' in node else node.get('refuri', ''))
+        if url.scheme or url.netloc or not url.path.endswith('.rst'):
+            continue
+        path = url.path[:-len('.rst')] + '.html'
+        if path.startswith('/'):
+            path = root_link(page_path) + path.lstrip('/')
+        node['refuri'] = urlunsplit(url._replace(path=path))
+
+
+def write_if_changed(path: str, content: str) -> bool:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            if f.read() == content:
+                return False
+    except FileNotFoundError:
+        os.makedirs(dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    return True
+
+
+def render_note(task):
+    """ Runs in worker process. Returns (full_path, error message or None) """
+    from docutils.core import publish_doctree, publish_parts     # heavy, so only workers import it
+    from docutils.io import DocTreeInput
+    from docutils.readers.doctree import Reader
+    from dnevnichok.links import register_roles
+
+    full_path, source, target = task
+    try:
+        with open(source, 'rb') as f:
+            content = f.read().decode('UTF-8')
+        register_roles()
+        doctree = publish_doctree(content, settings_overrides=DOCUTILS_SETTINGS)
+        rewrite_links(doctree, html_path(full_path))
+        parts = publish_parts(doctree, source_class=DocTreeInput, reader=Reader(parser_name='null'),
+                              writer_name='html', settings_overrides=DOCUTILS_SETTINGS)
+        page = PAGE.format(title=parts['title'] or html.escape(os.path.basename(full_path)),
+                           root=root_link(html_path(full_path)),
+                           body=parts['html_title'] + parts['docinfo'] + parts['body'])
+        write_if_changed(target, page)
+    except Exception as e:  # one broken note must not stop export
+        return full_path, str(e)
+    return full_path, None
+
+
+class Exporter:
+    def __init__(self, outdir=None, jobs=None, force=False):
+        self.notespath = config.get_path('notes')
+        self.outdir = outdir if outdir else config.get_path('export')
+        self.jobs = jobs
+        self.force = force
+        self._conn = get_connection()
+        self.manifest_path = join(self.outdir, MANIFEST)
+
+    def load_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        if self.force or manifest.get('settings') != settings_hash():
+            return {}
+        return manifest['notes']
+
+    def save_manifest(self, notes: dict):
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump({'settings': settings_hash(), 'notes': notes}, f)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def get_stale(self, paths, old: dict):
+        """ Compare sources with manifest. Returns (stale paths, new manifest).
+        File is read and hashed only if its stat changed """
+        stale, notes = [], {}
+        for full_path in paths:
+            source = join(self.notespath, full_path)
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                continue    # deleted after DB was populated
+            entry = old.get(full_path)
+            if entry and entry[:2] == [stat.st_mtime_ns, stat.st_size] and \
+                    exists(join(self.outdir, html_path(full_path))):
+                notes[full_path] = entry
+                continue
+            with open(source, 'rb') as f:
+                sha = blob_hash(f.read())
+            notes[full_path] = [stat.st_mtime_ns, stat.st_size, sha]
+            if not entry or entry[2] != sha or not exists(join(self.outdir, html_path(full_path))):
+                stale.append(full_path)
+        return stale, notes
+
+    def render(self, stale: list) -> list:
+        """ Render stale notes, return paths of those which failed """
+        tasks = [(p, join(self.notespath, p), join(self.outdir, html_path(p))) for p in stale]
+        if len(tasks) < POOL_THRESHOLD or self.jobs == 1:
+            return self.collect(map(render_note, tasks))
+        chunksize = max(1, len(tasks) // ((self.jobs or os.cpu_count() or 1) * 4))
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            return self.collect(pool.map(render_note, tasks, chunksize=chunksize))
+
+    def collect(self, results) -> list:
+        """ Log errors of rendering results, return paths of failed notes """
+        failed = []
+        for full_path, error in results:
+            if error:
+                logger.error("Can't export {}: {}".format(full_path, error))
+                failed.append(full_path)
+        return failed
+
+    def remove(self, paths):
+        for full_path in paths:
+            try:
+                os.remove(join(self.outdir, html_path(full_path)))
+            except FileNotFoundError:
+                pass
+
+    def note_list(self, rows, page_path: str) -> str:
+        root = root_link(page_path)
+        lines = ['<ul>']
+        for row in rows:
+            lines.append('<li><a href="{}{}">{}</a></li>'.format(root, html.escape(html_path(row['full_path'])),
+                                                              html.escape(row['title'])))
+        lines.append('</ul>')
+        return '\n'.join(lines)
+
+    def write_page(self, path: str, title: str, body: str) -> bool:
+        page = PAGE.format(title=html.escape(title), root=root_link(path),
+                           body='<h1>{}</h1>\n{}'.format(html.escape(title), body))
+        return write_if_changed(join(self.outdir, path), page)
+
+    def build_indexes(self):
+        """ index.html, tags/<tag>.html and months/<YYYY-MM>.html. Unchanged pages are not touched """
+        tags = OrderedDict()
+        for row in self._conn.execute("""SELECT t.title AS tag, n.title, n.full_path
+                                         FROM tags AS t
+                                         JOIN note_tags AS nt ON nt.tag_id = t.id
+                                         JOIN notes AS n ON n.id = nt.note_id
+                                         ORDER BY t.title, n.pub_ts DESC"""):
+            tags.setdefault(row['tag'], []).append(row)
+        months = OrderedDict()
+        for row in self._conn.execute("""SELECT strftime('%Y-%m', pub_ts, 'unixepoch', 'localtime') AS month,
+                                         title, full_path
+                                         FROM notes
+                                         WHERE pub_ts IS NOT NULL
+                                         ORDER BY pub_ts DESC"""):
+            months.setdefault(row['month'], []).append(row)
+
+        pages = set()
+        for tag, rows in tags.items():
+            path = 'tags/{}.html'.format(tag.replace('/', '_'))
+            self.write_page(path, 'Tag: ' + tag, self.note_list(rows, path))
+            pages.add(path)
+        for month, rows in months.items():
+            path = 'months/{}.html'.format(month)
+            self.write_page(path, month, self.note_list(rows, path))
+            pages.add(path)
+        for index_dir in ('tags', 'months'):     # tags and months which are gone
+            for name in os.listdir(join(self.outdir, index_dir)) if exists(join(self.outdir, index_dir)) else []:
+                if index_dir + '/' + name not in pages:
+                    os.remove(join(self.outdir, index_dir, name))
+
+        body = ['<h2>Tags</h2>', '<ul>']
+        body += ['<li><a href="tags/{}.html">{}</a> ({})</li>'.format(html.escape(tag.replace('/', '_')),
+                                                                 html.escape(tag), len(rows))
+                 for tag, rows in tags.items()]
+        body += ['</ul>', '<h2>Months</h2>', '<ul>']
+        body += ['<li><a href="months/{0}.html">{0}</a> ({1})</li>'.format(month, len(rows))
+                 for month, rows in months.items()]
+        body += ['</ul>', '<h2>Notes</h2>']
+        notes = self._conn.execute("""SELECT title, full_path FROM notes
+                                      ORDER BY pub_ts DESC, id DESC""")
+        body.append(self.note_list(notes, 'index.html'))
+        self.write_page('index.html', 'All notes', '\n'.join(body))
+
+    def ignore_in_notebook(self):
+        """ Keep pages out of git, if output dir is inside notebook """
+        inner = relpath(realpath(self.outdir), realpath(self.notespath))
+        gitignore = join(self.outdir, '.gitignore')
+        if inner.split(os.sep)[0] != os.pardir and inner != os.curdir and not exists(gitignore):
+            with open(gitignore, 'w') as f:
+                f.write('*\n')
+
+    def run(self) -> dict:
+        os.makedirs(self.outdir, exist_ok=True)
+        self.ignore_in_notebook()
+        paths = [row['full_path'] for row in self._conn.execute("SELECT full_path FROM notes")]
+        old = self.load_manifest()
+        stale, notes = self.get_stale(paths, old)
+        removed = [p for p in old if p not in notes]
+        logger.info("Export: {} of {} notes to render, {} to remove".format(len(stale), len(paths), len(removed)))
+
+        failed = self.render(stale)
+        for full_path in failed:
+            del notes[full_path]    # try again next time
+        self.remove(removed)
+        self.build_indexes()
+        self.save_manifest(notes)
+        return {'rendered': len(stale) - len(failed), 'skipped': len(paths) - len(stale),
+                'removed': len(removed), 'failed': len(failed)}
+
+
+def export_notes(outdir=None, jobs=None, force=False) -> dict:
+    return Exporter(outdir, jobs, force).run()
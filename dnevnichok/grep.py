@@ -0,0 +1,163 @@
+"""
+Search in content of note files. There is no full-text index, so files are
+scanned. Notes found in content cache are searched there. Big sets of other
+notes are split into chunks and scanned by pool of processes: every file is
+mmap'ed and searched as raw bytes with precompiled pattern, reading stops at
+the first hit. Results are given back chunk by chunk as they arrive. Files
+scanned by pool are read into content cache afterwards in background, while
+there is free room in it. Pool machinery (concurrent.futures, multiprocessing)
+is imported only by the first big search, so it doesn't slow down start.
+"""
+
+from functools import lru_cache
+import logging
+import mmap
+import os
+import re
+import threading
+
+from dnevnichok.contentcache import get_content_cache
+from dnevnichok.core import NoteItem
+
+logger = logging.getLogger(__name__)
+
+CHUNK = 64              # files per task for pool
+POOL_THRESHOLD = 256    # less files are scanned in place, it's faster than IPC
+
+_pool = None
+_pool_lock = threading.Lock()   # notebooks are searched from several threads
+_warmer = None
+
+
+def get_pool():
+    """ ProcessPoolExecutor. Pool is started on the first big search and lives until exit """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            from concurrent.futures import ProcessPoolExecutor
+            _pool = ProcessPoolExecutor()
+    return _pool
+
+
+def warm_cache(paths: list):
+    """ Read files into content cache in background thread, unless previous
+    warming is still running """
+    global _warmer
+    with _pool_lock:
+        if _warmer is None or not _warmer.is_alive():
+            _warmer = threading.Thread(target=get_content_cache().warm, args=(paths,), daemon=True)
+            _warmer.start()
+
+
+def case_sensitive(query: str) -> bool:
+    """ Query with upper-case letters is case-sensitive """
+    return any(c.isupper() for c in query)
+
+
+@lru_cache(maxsize=32)
+def compile_pattern(query: str):
+    """ Bytes pattern for query. re.IGNORECASE works only for ASCII in bytes,
+    so in other queries every cased letter is expanded to alternatives of its
+    UTF-8 forms """
+    if case_sensitive(query):
+        return re.compile(re.escape(query.encode('UTF-8')))
+    if all(ord(c) < 128 for c in query):
+        return re.compile(re.escape(query.encode('UTF-8')), re.IGNORECASE)
+    parts = []
+    for c in query:
+        forms = {c, c.lower(), c.upper()}
+        if len(forms) == 1:
+            parts.append(re.escape(c.encode('UTF-8')))
+        else:
+            parts.append(b'(?:' + b'|'.join(re.escape(f.encode('UTF-8')) for f in sorted(forms)) + b')')
+    return re.compile(b''.join(parts))
+
+
+def grep_file(path: str, pattern) -> bool:
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return False    # empty file can't be mapped
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as content:
+                return pattern.search(content) is not None
+    except OSError as e:
+        logger.warning(e)
+        return False
+
+
+def grep_chunk(pattern, chunk) -> list:
+    """ Runs in worker process. chunk is [(index, path)], return matched indexes """
+    return [i for i, path in chunk if grep_file(path, pattern)]
+
+
+def name_matches(item, query: str) -> bool:
+    """ Query is in title or file name of item """
+    if case_sensitive(query):
+        return item.title.find(query) > -1 or \
+            isinstance(item, NoteItem) and item.full_path.split('/')[-1].find(query) > -1
+    query = query.lower()
+    return item.title.lower().find(query) > -1 or \
+        isinstance(item, NoteItem) and item.full_path.split('/')[-1].lower().find(query) > -1
+
+
+def text_matches(texts, query: str) -> bool:
+    """ Search in (text, lower) from content cache """
+    text, lower = texts
+    return text.find(query) > -1 if case_sensitive(query) else lower.find(query.lower()) > -1
+
+
+def cached_grep(path: str, query: str) -> bool:
+    """ Search in cached content, reading it into cache if needed """
+    cache = get_content_cache()
+    try:
+        return text_matches((cache.get(path), cache.get_lower(path)), query)
+    except OSError as e:
+        logger.warning(e)
+        return False
+
+
+def content_matches(item, query: str) -> bool:
+    return isinstance(item, NoteItem) and cached_grep(item.full_path, query)
+
+
+def grep_items(items, query: str, cancelled=None, on_partial=None):
+    """ Items with query in title, file name or content, in original order.
+    on_partial(found so far) is called every time next chunk is scanned.
+    Return None if `cancelled` callback said that nobody waits for the
+    result anymore (e.g. user pressed another key)
+    """
+    cache = get_content_cache()
+    found, to_grep = {}, []
+    for i, item in enumerate(items):
+        if name_matches(item, query):
+            found[i] = item
+        elif isinstance(item, NoteItem):
+            texts = cache.peek(item.full_path)
+            if texts is None:
+                to_grep.append((i, item.full_path))
+            elif text_matches(texts, query):
+                found[i] = item
+    pattern = compile_pattern(query)
+    chunks = [to_grep[i:i+CHUNK] for i in range(0, len(to_grep), CHUNK)]
+    ordered = lambda: [found[i] for i in sorted(found)]
+
+    if len(to_grep) < POOL_THRESHOLD:   # small enough to read into cache for next searches
+        results = ([i for i, path in chunk if cached_grep(path, query)] for chunk in chunks)
+        futures = []
+    else:
+        from concurrent.futures import as_completed
+        futures = [get_pool().submit(grep_chunk, pattern, chunk) for chunk in chunks]
+        results = (future.result() for future in as_completed(futures))
+
+    for matched in results:
+        if cancelled and cancelled():
+            for future in futures:
+                future.cancel()
+            return None
+        for i in matched:
+            found[i] = items[i]
+        if on_partial and matched:
+            on_partial(ordered())
+    if futures:     # next searches in these notes won't need pool
+        warm_cache([path for i, path in to_grep])
+    return ordered()
@@ -0,0 +1,87 @@
+"""
+Index of commits touching every file, to show history of note without
+running git log for it. Built with one walk over whole history and then
+extended only with commits made after the last indexed one. If that commit
+isn't ancestor of HEAD anymore (rebase, branch switch) index is built again.
+Lives in its own DB file (``history`` in [Paths]), like parse cache, so it
+survives repopulation and doesn't touch the index and its snapshot. Tables
+are created on the first use of history, so read-only runs (query, daemon)
+don't create the file.
+"""
+
+import logging
+
+from dnevnichok.backend import GitCommandBackend
+from dnevnichok.config import config
+from dnevnichok.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryIndex:
+    def __init__(self, path=None):
+        self.path = path if path else config.get_path('history')
+        self.backend = GitCommandBackend()
+        self._created = False
+
+    def ensure_tables(self):
+        if self._created:
+            return
+        with self._conn:
+            cur = self._conn.cursor()
+            cur.execute("""CREATE TABLE IF NOT EXISTS
+                           commits(id INTEGER PRIMARY KEY, sha TEXT UNIQUE, ts INTEGER,
+                           author TEXT, subject TEXT)""")
+            cur.execute("""CREATE TABLE IF NOT EXISTS
+                           file_commits(full_path TEXT, commit_id INTEGER, status TEXT,
+                           PRIMARY KEY (full_path, commit_id)) WITHOUT ROWID""")
+            cur.execute("""CREATE TABLE IF NOT EXISTS
+                           history_head(sha TEXT)""")
+        self._created = True
+
+    @property
+    def _conn(self):
+        return get_connection(self.path)
+
+    def get_indexed_head(self):
+        row = self._conn.execute("SELECT sha FROM history_head").fetchone()
+        return row['sha'] if row else None
+
+    def update(self):
+        """ Index commits made since last update. Cheap if there are none """
+        self.ensure_tables()
+        head = self.backend.get_head()
+        indexed = self.get_indexed_head()
+        if head == indexed:
+            return
+        with self._conn:
+            cur = self._conn.cursor()
+            if not head or indexed and not self.backend.is_ancestor(indexed, head):
+                logger.info("History was rewritten, indexing it again")
+                indexed = None
+            if not indexed:
+                cur.execute("DELETE FROM file_commits")
+                cur.execute("DELETE FROM commits")
+            count = 0
+            for sha, epoch, author, subject, files in self.backend.walk_history(indexed) if head else ():
+                cur.execute("""INSERT INTO commits(sha, ts, author, subject)
+                               VALUES(?, ?, ?, ?)""", (sha, epoch, author, subject))
+                commit_id = cur.lastrowid
+                cur.executemany("""INSERT OR REPLACE INTO file_commits(full_path, commit_id, status)
+                                   VALUES(?, ?, ?)""",
+                                (('./' + path, commit_id, status) for status, path in files))
+                count += 1
+            cur.execute("DELETE FROM history_head")
+            if head:
+                cur.execute("INSERT INTO history_head(sha) VALUES(?)", (head,))
+        logger.info("Indexed {} commits".format(count))
+
+    def revisions(self, full_path: str) -> list:
+        """ Commits touching note, the latest first """
+        self.ensure_tables()
+        return self._conn.execute("""SELECT c.id, c.sha, c.ts, c.author, c.subject AS title,
+                                     fc.full_path, fc.status
+                                     FROM file_commits AS fc
+                                     JOIN commits AS c ON (c.id = fc.commit_id)
+                                     WHERE fc.full_path = ?
+                                     ORDER BY c.id DESC""", (full_path,)).fetchall()
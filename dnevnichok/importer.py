@@ -0,0 +1,156 @@
+"""
+Import of external tree of reStructuredText files into notebook.
+Files are streamed: walked in sorted order, copied, parsed and inserted in
+batches, one transaction per batch, so memory doesn't depend on size of the
+tree. Every batch commits checkpoint (last imported path) together with its
+notes, so interrupted import continues right after the last finished batch.
+Notes which are already indexed at destination are skipped, so import can
+be simply repeated too.
+"""
+
+import filecmp
+from itertools import dropwhile, islice
+import logging
+import os
+import shutil
+import time
+
+from dnevnichok.config import config
+from dnevnichok.db import get_connection
+from dnevnichok.dirmap import DirMap, normalize
+from dnevnichok.events import event_hub
+from dnevnichok.parsecache import get_parse_cache
+from dnevnichok.populate import insert_dir, insert_note, parse_note, repo
+from dnevnichok.snapshot import snapshot_enabled, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+BATCH = 200     # files per transaction and per git call
+
+
+class ImporterError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def walk_sorted(root: str, parts=()):
+    """ Relative paths of .rst files as tuples of their parts. Entries of
+    every dir are sorted by name, so paths go in tuple order and position in
+    the walk can be compared with checkpoint. Hidden dirs are skipped """
+    with os.scandir(os.path.join(root, *parts)) as it:
+        entries = sorted(it, key=lambda entry: entry.name)
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            if not entry.name.startswith('.'):
+                yield from walk_sorted(root, parts + (entry.name,))
+        elif entry.name.endswith('.rst') and entry.is_file():
+            yield parts + (entry.name,)
+
+
+def batches(iterable, size: int):
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+class Importer:
+    def __init__(self, source: str, dest=None, batch=BATCH, git_add=False):
+        """ `dest` is dir in notebook, by default the one named as source """
+        notespath = os.path.realpath(config.get_path('notes'))
+        self.source = os.path.realpath(source)
+        if not os.path.isdir(self.source):
+            raise ImporterError("{} isn't a directory".format(source))
+        if os.path.commonpath([self.source, notespath]) in (self.source, notespath):
+            raise ImporterError("Source and notebook can't contain one another")
+        self.dest = normalize(dest if dest is not None else os.path.basename(self.source))
+        if '..' in self.dest.split('/'):
+            raise ImporterError("Destination must be inside notebook")
+        self.batch = batch
+        self.git_add = git_add
+        self.conn = get_connection()
+        dir_map = DirMap()
+        dir_map.load(self.conn)
+        self.dir_ids = dict(dir_map.ids)    # grows with created dirs
+        self.tags_cache = {}
+        self.stats = {'imported': 0, 'skipped': 0, 'conflicts': 0, 'failed': 0}
+
+    def get_checkpoint(self):
+        """ Parts of the last imported path and number of imported notes, if
+        previous import of the same source was interrupted """
+        row = self.conn.execute("SELECT last_path, imported FROM import_state WHERE source = ? AND dest = ?",
+                                (self.source, self.dest)).fetchone()
+        return (tuple(row[0].split('/')), row[1]) if row else (None, 0)
+
+    def get_dir(self, cur, path: str) -> int:
+        """ Id of dir in DB, created with all its parents if needed """
+        if path not in self.dir_ids:
+            parent, title = path.rsplit('/', 1)
+            self.dir_ids[path] = insert_dir(cur, title, self.get_dir(cur, parent))
+        return self.dir_ids[path]
+
+    def import_file(self, cur, parts) -> bool:
+        """ Copy file into notebook and index it. True if it was indexed """
+        from docutils.utils import SystemMessage
+
+        source = os.path.join(self.source, *parts)
+        path = '/'.join((self.dest,) + parts)
+        if cur.execute("SELECT 1 FROM notes WHERE full_path = ?", (path,)).fetchone():
+            self.stats['skipped'] += 1
+            return False
+        if os.path.exists(path):
+            if not filecmp.cmp(source, path, shallow=False):    # may be copied by interrupted import
+                logger.warning("Not imported {}: {} already exists".format(source, path))
+                self.stats['conflicts'] += 1
+                return False
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copy2(source, path)
+
+        dir_id = self.get_dir(cur, os.path.dirname(path))
+        try:
+            note = parse_note(path, dir_id, committed=False)
+        except (UnicodeDecodeError, SystemMessage) as e:
+            logger.warning("Can't parse {}: {}".format(path, e))
+            self.stats['failed'] += 1
+            return False
+        insert_note(cur, note, self.tags_cache)
+        cur.execute("UPDATE dirs SET size = size + 1 WHERE id = ?", (dir_id,))
+        self.stats['imported'] += 1
+        return True
+
+    def run(self) -> dict:
+        started = time.perf_counter()
+        checkpoint, imported = self.get_checkpoint()
+        files = walk_sorted(self.source)
+        if checkpoint:
+            logger.info("Resuming import of {} after {}".format(self.source, '/'.join(checkpoint)))
+            files = dropwhile(lambda parts: parts <= checkpoint, files)
+
+        for batch in batches(files, self.batch):
+            with self.conn:
+                cur = self.conn.cursor()
+                added = ['/'.join((self.dest,) + parts) for parts in batch if self.import_file(cur, parts)]
+                if self.git_add and added:  # before commit, so checkpoint never skips not added files
+                    if not repo.add_paths(added):
+                        logger.warning("git add of {} files failed".format(len(added)))
+                imported += len(added)
+                cur.execute("""INSERT OR REPLACE INTO import_state(source, dest, last_path, imported)
+                               VALUES(?, ?, ?, ?)""", (self.source, self.dest, '/'.join(batch[-1]), imported))
+            logger.info("Imported {} notes of {} in {:.1f} s".format(
+                imported, self.source, time.perf_counter() - started))
+
+        with self.conn:
+            self.conn.execute("DELETE FROM import_state WHERE source = ? AND dest = ?", (self.source, self.dest))
+        event_hub.trigger(('dirs-changed',))
+        get_parse_cache().evict()
+        if snapshot_enabled():
+            write_snapshot(config.get_path('db'), config.get_path('snapshot'))
+        return self.stats
+
+
+def import_tree(source: str, dest=None, batch=BATCH, git_add=False) -> dict:
+    """ Return numbers of imported, skipped, conflicting and failed files.
+    Must be called from notebook's dir """
+    return Importer(source, dest, batch, git_add).run()
@@ -0,0 +1,78 @@
+"""
+References between notes. Both plain reST links to other notes (`b.rst`_,
+`<../work/a.html>`_) and Sphinx-like :doc:`../work/a` role are recognized.
+Targets are stored as normalized paths (./work/a.rst), the same as notes.full_path,
+so link to note which isn't indexed yet starts working as soon as it is.
+"""
+
+from os.path import dirname, join, normpath
+from urllib.parse import urlsplit
+
+from dnevnichok.aux import find_nodes
+
+
+def doc_role(name, rawtext, text, lineno, inliner, options={}, content=[]):
+    """ :doc:`path` or :doc:`Title <path>`, rendered as link to path.html """
+    from docutils import nodes
+    from docutils.parsers.rst.roles import set_classes
+    from docutils.utils import unescape
+
+    text = unescape(text)
+    if text.endswith('>') and '<' in text:
+        title, target = text[:-1].rsplit('<', 1)
+        title = title.strip()
+    else:
+        title = target = text
+    set_classes(options)
+    node = nodes.reference(rawtext, title or target, refuri=target + '.html', **options)
+    node['refdoc'] = target
+    return [node], []
+
+
+def register_roles():
+    """ Must be called before parsing notes """
+    from docutils.parsers.rst import roles
+    roles.register_local_role('doc', doc_role)
+
+
+def resolve(note_path: str, target: str):
+    """ Path of note linked by `target` from note at `note_path` or None if it's
+    not a link to note (external url, anchor, image etc).
+    Paths starting with / are relative to notebook root
+    """
+    url = urlsplit(target)
+    if url.scheme or url.netloc or not url.path:
+        return None
+    path = url.path
+    if path.endswith('.html') or path.endswith('.txt'):
+        path = path.rsplit('.', 1)[0] + '.rst'
+    elif not path.endswith('.rst'):
+        if '.' in path.rsplit('/', 1)[-1]:
+            return None     # some other file
+        path += '.rst'
+    if path.startswith('/'):
+        path = normpath('.' + path)
+    else:
+        path = normpath(join(dirname(note_path), path))
+    if path.startswith('..'):
+        return None         # outside of notebook
+    return './' + path
+
+
+def get_targets(doctree) -> list:
+    """ Raw targets of all references in doctree. They don't depend on
+    note's path, so can be cached by content """
+    from docutils import nodes
+
+    targets = (node.get('refdoc') or node.get('refuri') for node in find_nodes(doctree, nodes.reference))
+    return [target for target in targets if target]
+
+
+def note_links(note_path: str, targets) -> list:
+    """ Unique paths of notes referenced from note at `note_path` """
+    links = []
+    for target in targets:
+        path = resolve(note_path, target)
+        if path and path not in links and path != './' + normpath(note_path):
+            links.append(path)
+    return links
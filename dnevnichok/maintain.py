@@ -0,0 +1,145 @@
+"""
+Keeping cache DB fast without rebuilding it: remove rows which lost their
+notes or tags, recount tag statistics, refresh planner statistics and give
+free pages back to the file system. Report tells what was done, how big
+tables and indexes are and how long every step took.
+"""
+
+import logging
+import sqlite3
+import time
+
+from dnevnichok.config import config
+from dnevnichok.db import get_connection
+from dnevnichok.schema import recount_tag_stats
+from dnevnichok.snapshot import snapshot_enabled, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+VACUUM_PAGES = 1000     # pages given back by one incremental vacuum
+
+# What is left behind by deletes on DBs populated before triggers existed
+ORPHANS = (
+    ('note_tags without note', "DELETE FROM note_tags WHERE note_id NOT IN (SELECT id FROM notes)"),
+    ('note_tags without tag', "DELETE FROM note_tags WHERE tag_id NOT IN (SELECT id FROM tags)"),
+    ('unused tags', "DELETE FROM tags WHERE id NOT IN (SELECT tag_id FROM note_tags)"),
+    ('trigrams without note', "DELETE FROM trigrams WHERE note_id NOT IN (SELECT id FROM notes)"),
+    ('links without note', "DELETE FROM links WHERE source_id NOT IN (SELECT id FROM notes)"),
+)
+
+# Hot queries of managers, their plans show whether indexes are still used
+QUERIES = (
+    ('notes by date', "SELECT id FROM notes ORDER BY pub_ts DESC, id DESC LIMIT 50", ()),
+    ('next page by date', """SELECT id FROM notes WHERE pub_ts <= ? AND (pub_ts < ? OR id < ?)
+                              ORDER BY pub_ts DESC, id DESC LIMIT 50""", (0, 0, 0)),
+    ('notes by name', "SELECT id FROM notes ORDER BY title COLLATE NOCASE, id LIMIT 50", ()),
+    ('notes in dir', "SELECT id FROM notes WHERE dir_id = ?", (1,)),
+    ('notes in period', "SELECT id FROM notes WHERE pub_ts >= ? AND pub_ts < ?", (0, 1)),
+    ('tag list', """SELECT t.title, s.size FROM tags AS t JOIN tag_stats AS s ON (s.tag_id = t.id)
+                     ORDER BY t.title DESC""", ()),
+    ('notes with tag', """SELECT n.id FROM notes AS n JOIN note_tags AS nt ON (nt.note_id = n.id)
+                           WHERE nt.tag_id = ?""", (1,)),
+    ('backlinks', """SELECT n.id FROM links AS l JOIN notes AS n ON (n.id = l.source_id)
+                      WHERE l.target_path = ?""", ('./a.rst',)),
+)
+
+
+class Maintenance:
+    def __init__(self, conn=None, vacuum=False):
+        self.conn = conn if conn else get_connection()
+        self.vacuum = vacuum
+        self.lines = []
+
+    def report(self, line: str):
+        self.lines.append(line)
+        logger.info(line)
+
+    def step(self, name, func):
+        started = time.perf_counter()
+        func()
+        self.report('{}: {:.0f} ms'.format(name, (time.perf_counter() - started) * 1000))
+
+    def remove_orphans(self):
+        with self.conn:
+            for name, sql in ORPHANS:
+                try:
+                    removed = self.conn.execute(sql).rowcount
+                except sqlite3.OperationalError as e:  # table may be missing in old DB
+                    logger.debug("Skip {}: {}".format(name, e))
+                    continue
+                if removed:
+                    self.report('Removed {} {}'.format(removed, name))
+
+    def recount_tags(self):
+        """ tag_stats is kept by triggers, but DB may have been changed by older dnevnichok """
+        with self.conn:
+            recount_tag_stats(self.conn.cursor())
+
+    def analyze(self):
+        self.conn.execute("ANALYZE")
+        self.conn.execute("PRAGMA optimize")
+
+    def free_pages(self):
+        """ First run switches DB to incremental auto vacuum, which needs one
+        full VACUUM, later runs give back at most VACUUM_PAGES free pages """
+        free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if self.conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            self.conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            self.conn.execute("VACUUM")
+        else:
+            self.conn.execute("PRAGMA incremental_vacuum({})".format(VACUUM_PAGES))
+        left = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+        self.report('Free pages: {} -> {}'.format(free, left))
+
+    def report_sizes(self):
+        """ Size of every table and index, with rows per key from ANALYZE for indexes """
+        page_size = self.conn.execute("PRAGMA page_size").fetchone()[0]
+        stats = dict(self.conn.execute("SELECT idx, stat FROM sqlite_stat1 WHERE idx IS NOT NULL"))
+        try:
+            sizes = self.conn.execute("""SELECT name, SUM(pgsize) FROM dbstat
+                                         GROUP BY name ORDER BY 2 DESC""").fetchall()
+        except sqlite3.OperationalError:     # SQLite without dbstat
+            sizes = [(name, None) for name, in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('table', 'index')")]
+        for name, size in sizes:
+            stat = stats.get(name)
+            size = '{:.1f} KB'.format(size / 1024) if size is not None else '?'
+            if stat:    # "rows rows-per-first-column ..."
+                rows, *per_key = stat.split()
+                self.report('{:<30} {:>10}  {} rows, {} per key'.format(name, size, rows, '/'.join(per_key)))
+            else:
+                self.report('{:<30} {:>10}'.format(name, size))
+        pages = self.conn.execute("PRAGMA page_count").fetchone()[0]
+        self.report('Total: {:.1f} KB'.format(pages * page_size / 1024))
+
+    def report_plans(self):
+        for name, sql, args in QUERIES:
+            try:
+                plan = [row[3] for row in self.conn.execute("EXPLAIN QUERY PLAN " + sql, args)]
+            except sqlite3.OperationalError as e:
+                plan = [str(e)]
+            self.report('{:<17} {}'.format(name, '; '.join(plan)))
+
+    def check(self):
+        result = self.conn.execute("PRAGMA quick_check").fetchone()[0]
+        self.report('Integrity: ' + result)
+
+    def run(self) -> list:
+        started = time.perf_counter()
+        self.step('Orphans', self.remove_orphans)
+        self.step('Tag statistics', self.recount_tags)
+        self.step('ANALYZE and optimize', self.analyze)
+        if self.vacuum:
+            self.step('Vacuum', self.free_pages)
+        self.step('Integrity check', self.check)
+        if snapshot_enabled():
+            self.step('Snapshot', lambda: write_snapshot(config.get_path('db'), config.get_path('snapshot')))
+        self.report_sizes()
+        self.report_plans()
+        self.report('Done in {:.0f} ms'.format((time.perf_counter() - started) * 1000))
+        return self.lines
+
+
+def maintain(vacuum=False) -> list:
+    """ Returns lines of report """
+    return Maintenance(vacuum=vacuum).run()
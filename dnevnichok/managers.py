@@ -4,24 +4,43 @@ Each created only once and assigned to application.
 Application itself decides when to switch over managers.
 """
 
-from collections import deque
-import curses
+from collections import deque, OrderedDict
 import inspect
 import logging
+import os
 import sqlite3
 import subprocess
 import sys
+import tempfile
 
+from dnevnichok.aux import KeysetPagedItems, LazyPagedItems
 from dnevnichok.backend import GitCommandBackend
-from dnevnichok.core import DirItem, MonthItem, NoteItem, TagItem
+from dnevnichok.core import DirItem, MonthItem, NoteItem, PeriodItem, RevisionItem, TagItem, period_bounds
 from dnevnichok.config import config
+from dnevnichok.db import get_connection
+from dnevnichok.dirmap import DirMap
 from dnevnichok.events import event_hub
+from dnevnichok.history import HistoryIndex
+from dnevnichok.notebooks import read_notebooks
 from dnevnichok.populate import repopulate_db
+from dnevnichok.profiling import profiled, profiled_iter, profiling_enabled
+from dnevnichok.schema import ensure_schema
+from dnevnichok.search import fuzzy_find
+from dnevnichok.snapshot import open_snapshot
+from dnevnichok.tagquery import TagBitmaps, compile_query, from_bitmap
 
 logger = logging.getLogger(__name__)
-dbpath = config.get_path('db')
-backend = GitCommandBackend()
-backend.update_statuses()
+backend = GitCommandBackend()     # statuses are updated by managers right before use
+
+# Sort modes for notes: name -> (sort key expression, direction).
+# Every expression has an index with the same expression in schema, so
+# ORDER BY ... LIMIT walks the index instead of sorting the whole result.
+# Notes without pub_ts (not commited yet, except diary) go last on date sort.
+SORTS = OrderedDict([
+    ('date', ("pub_ts", 'DESC')),
+    ('name', ("title COLLATE NOCASE", 'ASC')),
+    ('size', ("size", 'DESC')),
+])
 
 
 def add_git_status(row: sqlite3.Row):
@@ -39,10 +58,13 @@ class EmptyManagerException(Exception):
 
 
 class ManagerInterface:
-    _conn = sqlite3.connect(dbpath)
-    _conn.row_factory = sqlite3.Row
     _notes = []
     base = None     # where we now
+    sort = 'date'   # one of SORTS, shared by all managers
+
+    @property
+    def _conn(self):
+        return get_connection()
 
     def chpath(self, path):
         """Return none. Just changes current state"""
@@ -65,17 +87,18 @@ class ManagerInterface:
         else:
             item = DirItem(last_active)
         items = self.get_items()
-        last_active_index = items.index(item)
+        last_active_index = items.index(item) if item in items else 0
         event_hub.trigger(('show', items, last_active_index))
 
     def process_root(self):
         """Called on initialization of every manager """
-        items = self.get_items()
+        items = self.get_paged_items()
         event_hub.trigger(('show', items))
 
     def process_open(self, item):
         active = None
         if isinstance(item, NoteItem):
+            import curses   # managers are also used headless, without curses
             subprocess.call(["vim", item.get_path()])
             active = item
             curses.curs_set(1)  # THIS is sought-for hack
@@ -94,19 +117,75 @@ class ManagerInterface:
                            FROM tags AS t
                            JOIN note_tags AS nt ON (t.id = nt.tag_id)
                            JOIN notes AS n ON (n.id = nt.note_id)
-                           WHERE n.id = {}""".format(id))
+                           WHERE n.id = ?""", (id,))
             tags = sorted([tag['title'] for tag in cur.fetchall()])
             return tags
 
+    def order_sql(self, sql: str) -> str:
+        """Wrap notes SELECT into current sort order"""
+        expr, direction = SORTS[self.sort]
+        return """SELECT * FROM ({}) ORDER BY {} {}, id {}""".format(sql, expr, direction, direction)
+
+    def keyset_seeks(self, after) -> list:
+        """(condition, args) of rows right after `after` (sort_key, id) pair in
+        current order, to be read in turn. Key is compared alone first, so the
+        index is searched (row values or OR of comparisons make it scanned).
+        NULL keys are a group of their own: last on DESC, first on ASC"""
+        expr, direction = SORTS[self.sort]
+        op = '<' if direction == 'DESC' else '>'
+        if after is None:
+            return [('', [])]
+        key, last_id = after
+        if key is None:
+            seeks = [('{0} IS NULL AND id {1} ?', [last_id])]
+            if direction == 'ASC':
+                seeks.append(('{0} IS NOT NULL', []))
+        else:
+            seeks = [('{0} {1}= ? AND ({0} {1} ? OR id {1} ?)', [key, key, last_id])]
+            if direction == 'DESC':
+                seeks.append(('{0} IS NULL', []))
+        return [('WHERE ' + where.format(expr, op), args) for where, args in seeks]
+
+    def keyset_sql(self, sql: str, where='') -> str:
+        """Wrap notes SELECT into current sort order, filtered by seek condition
+        and limited by one more parameter"""
+        expr, direction = SORTS[self.sort]
+        return """SELECT *, {expr} AS sort_key FROM ({sql}) {where}
+                  ORDER BY {expr} {dir}, id {dir} LIMIT ?""".format(expr=expr, sql=sql, where=where, dir=direction)
+
+    def make_items(self, rows) -> list:
+        return [NoteItem(row[0], add_git_status(row), tags=self.get_tags(row[0])) for row in rows]
+
+    def snapshot_item(self, snapshot, position) -> NoteItem:
+        row = snapshot.row(position)
+        return NoteItem(row['id'], add_git_status(row), tags=snapshot.get_tags(position))
+
+    def get_snapshot(self):
+        """Snapshot is stored in default order only"""
+        return open_snapshot() if self.sort == 'date' else None
+
     def get_items(self) -> list:
         """Return list of dnevnichok.core.Items
         If you wish to overload get_items() don't forget to invoke fetch_items"""
         backend.update_statuses()
         self.fetch_items()
 
-        return sorted([NoteItem(row[0], add_git_status(row), tags=self.get_tags(row[0])) for row in self._notes],
-                      key=lambda i: i.pub_date if i.pub_date else 'Z',
-                      reverse=True)
+        return self.make_items(self._notes)
+
+    def get_paged_items(self):
+        """Same as get_items, but items may be fetched page by page when
+        manager supports it"""
+        return self.get_items()
+
+    def iter_items(self):
+        """Generate NoteItems one by one straight from cursor, without
+        building list. Used by headless CLI with managers having notes_query.
+        Query runs right away, so EmptyManagerException isn't deferred"""
+        backend.update_statuses()
+        sql, args = self.notes_query()
+        cur = self._conn.cursor()
+        cur.execute(self.order_sql(sql), args)
+        return (NoteItem(row[0], add_git_status(row), tags=self.get_tags(row[0])) for row in cur)
 
 
 class OneSelectManagerInterface(ManagerInterface):
@@ -120,18 +199,44 @@ class OneSelectManagerInterface(ManagerInterface):
         if not self.sql:
             raise NotImplemented("User class should give a SQL SELECT statement")
 
+    def notes_query(self):
+        if hasattr(self, 'update_sql'):
+            self.update_sql()
+            return self.get_sql(), self.sql_args
+        return self.get_sql(), ()
+
     def fetch_items(self):
         with self._conn:
             cur = self._conn.cursor()
-            if hasattr(self, 'update_sql'):
-                self.update_sql()
-                cur.execute(self.get_sql(), self.sql_args)
-            else:
-                cur.execute(self.get_sql())
+            sql, args = self.notes_query()
+            cur.execute(self.order_sql(sql), args)
             self._notes = cur.fetchall()
             if not self._notes:
                 raise EmptyManagerException
 
+    def fetch_page(self, after, limit):
+        """Fetch `limit` items following `after` key. Return items and key of last one"""
+        args = list(self.sql_args) if hasattr(self, 'update_sql') else []
+        rows = []
+        with self._conn:
+            cur = self._conn.cursor()
+            for where, seek_args in self.keyset_seeks(after):
+                cur.execute(self.keyset_sql(self.get_sql(), where), args + seek_args + [limit - len(rows)])
+                rows.extend(cur.fetchall())
+                if len(rows) >= limit:
+                    break
+        last_key = (rows[-1]['sort_key'], rows[-1]['id']) if rows else after
+        return self.make_items(rows), last_key
+
+    def get_paged_items(self):
+        backend.update_statuses()
+        if hasattr(self, 'update_sql'):
+            self.update_sql()
+        items = KeysetPagedItems(self.fetch_page)
+        if not items:
+            raise EmptyManagerException
+        return items
+
     def get_sql(self) -> str:
         return self.sql
 
@@ -149,6 +254,9 @@ class CategoryManagerInterface(OneSelectManagerInterface):
     def get_category_sql(self) -> str:
         return self.category_sql
 
+    def notes_query(self):
+        return self.get_sql(), (self.base,)
+
     def fetch_items(self):
         with self._conn:
             cur = self._conn.cursor()
@@ -156,7 +264,8 @@ class CategoryManagerInterface(OneSelectManagerInterface):
                 cur.execute(self.get_category_sql())
                 self.categories = cur.fetchall()
             else:
-                cur.execute(self.get_sql().format(self.base))
+                sql, args = self.notes_query()
+                cur.execute(self.order_sql(sql), args)
                 self._notes = cur.fetchall()
 
     def root(self):
@@ -179,17 +288,27 @@ class CategoryManagerInterface(OneSelectManagerInterface):
         self.fetch_items()
 
         if self.base is None:
-            return sorted([self.category_class(category[0], category) for category in self.categories],
-                          key=lambda i: i.get_path(),
-                          reverse=True)
+            return [self.category_class(category[0], category) for category in self.categories]
         else:
             return super().get_items()
 
+    def get_paged_items(self):
+        return self.get_items()
+
 
 class AllManager(OneSelectManagerInterface):
     key = 'a'
     sql = "SELECT * FROM notes"
 
+    def get_paged_items(self):
+        snapshot = self.get_snapshot()
+        if snapshot is None:
+            return super().get_paged_items()
+        if not len(snapshot):
+            raise EmptyManagerException
+        backend.update_statuses()
+        return LazyPagedItems(range(len(snapshot)), lambda i: self.snapshot_item(snapshot, i))
+
 
 class FavoritesManager(OneSelectManagerInterface):
     key = 'F'
@@ -197,14 +316,151 @@ class FavoritesManager(OneSelectManagerInterface):
 
 
 class ModifiedManager(OneSelectManagerInterface):
+    """ Modified paths are kept in temporary table, synced from cached git
+    status, so statement is always the same and has no parameters limit
+    """
     key = 'M'
-    sql = "SELECT * FROM notes WHERE full_path IN ({})"
-    sql_args = []
+    sql = """SELECT n.*
+             FROM modified AS m
+             JOIN notes AS n ON (n.full_path = m.full_path)"""
+    sql_args = ()
+    _synced_status = None
+
+    def update_sql(self):
+        if self._synced_status == backend.notes_status:
+            return
+        with self._conn:
+            cur = self._conn.cursor()
+            cur.execute("""CREATE TEMP TABLE IF NOT EXISTS
+                           modified(full_path TEXT PRIMARY KEY)""")
+            cur.execute("DELETE FROM modified")
+            cur.executemany("INSERT OR IGNORE INTO modified(full_path) VALUES(?)",
+                            (('./' + path,) for path in backend.notes_status.keys()))
+        self._synced_status = dict(backend.notes_status)
+
+
+class TagQueryManager(OneSelectManagerInterface):
+    """ Notes matching boolean tag query like `work & !archived | meeting`.
+    Has no key, switched by `query` command
+    """
+    key = None
+    sql = """SELECT n.*
+             FROM tag_query AS q
+             JOIN notes AS n ON (n.id = q.note_id)"""
+    sql_args = ()
+
+    def __init__(self):
+        self.query = None
+        self._compiled = None
+        self._result = None
+        self.bitmaps = TagBitmaps()
+        event_hub.register('tags-changed', self.bitmaps.changed)
+
+    def set_query(self, query: str):
+        """Raise TagQueryError if query is malformed"""
+        self._compiled = compile_query(query)
+        self.query = query
+
+    def update_sql(self):
+        if self._compiled is None:
+            raise EmptyManagerException
+        result = self.bitmaps.query(self._conn, self._compiled)
+        if result == self._result:
+            return
+        with self._conn:
+            cur = self._conn.cursor()
+            cur.execute("""CREATE TEMP TABLE IF NOT EXISTS
+                           tag_query(note_id INTEGER PRIMARY KEY)""")
+            cur.execute("DELETE FROM tag_query")
+            cur.executemany("INSERT INTO tag_query(note_id) VALUES(?)",
+                            ((note_id,) for note_id in from_bitmap(result)))
+        self._result = result
+
+
+class BacklinksManager(OneSelectManagerInterface):
+    """ Notes referencing chosen one, straight from links index.
+    Has no key, switched by `backlinks` command
+    """
+    key = None
+    sql = """SELECT n.*
+             FROM links AS l
+             JOIN notes AS n ON (n.id = l.source_id)
+             WHERE l.target_path = ?"""
+    sql_args = ()
+
+    def __init__(self):
+        self.target = None
+
+    def set_target(self, path: str):
+        self.target = path
 
     def update_sql(self):
-        self.sql_args  = ['./' + path for path in backend.notes_status.keys()]
-        placeholders = ', '.join('?' for _ in self.sql_args)
-        self.sql = ModifiedManager.sql.format(placeholders)
+        if self.target is None:
+            raise EmptyManagerException
+        self.sql_args = (self.target,)
+
+
+class NotebooksManager(ManagerInterface):
+    """ Notes of all notebooks by date, read from their shards concurrently.
+    Has no key, switched by `notebooks` command
+    """
+    key = None
+
+    def __init__(self):
+        self.query = None
+
+    def set_query(self, query: str):
+        self.query = query if query else None
+
+    def get_items(self):
+        items = read_notebooks(self.query)
+        if not items:
+            raise EmptyManagerException
+        return items
+
+    def get_paged_items(self):
+        return self.get_items()
+
+
+class HistoryManager(ManagerInterface):
+    """ Commits touching chosen note, from history index. Opening one shows
+    note as it was after that commit, read-only.
+    Has no key, switched by `history` command
+    """
+    key = None
+
+    def __init__(self):
+        self.index = HistoryIndex()
+
+    def chpath(self, path):
+        self.base = path
+
+    def get_items(self):
+        if self.base is None:
+            raise EmptyManagerException
+        self.index.update()
+        items = [RevisionItem(row['id'], row) for row in self.index.revisions(self.base)]
+        if not items:
+            raise EmptyManagerException
+        return items
+
+    def get_paged_items(self):
+        return self.get_items()
+
+    def process_open(self, item):
+        if not isinstance(item, RevisionItem):
+            return super().process_open(item)
+        import curses
+        # Deleted in this commit, so show the last version
+        commit = item.sha + '^' if item.status == 'D' else item.sha
+        with tempfile.TemporaryDirectory(prefix='dnevnichok-') as tmp:
+            path = os.path.join(tmp, '{}@{}'.format(os.path.basename(item.get_path()), item.sha[:7]))
+            with open(path, 'wb') as f:
+                f.write(backend.show_file(commit, item.get_path()))
+            os.chmod(path, 0o400)
+            subprocess.call(['vim', '-R', '-c', 'set filetype=rst', path])
+        curses.curs_set(1)  # THIS is sought-for hack
+        curses.curs_set(0)
 
 
 class FileManager(ManagerInterface):
@@ -213,38 +469,30 @@ class FileManager(ManagerInterface):
     def __init__(self):
         self._dirs = []
         self._bases = deque()
+        self.dir_map = DirMap()
+        event_hub.register('dirs-changed', self.dir_map.invalidate)
         self.root_path = 1
         self.base = self.root_path
         self.chpath(self.root_path)
 
+    def get_dir_map(self) -> DirMap:
+        self.dir_map.load(self._conn)
+        return self.dir_map
+
     def get_current_path(self):
-        with self._conn:
-            cur = self._conn.cursor()
-            cur.execute("""SELECT d.title
-                           FROM dirs_path AS dp
-                           JOIN dirs as d
-                           ON dp.ancestor == d.id
-                           WHERE descendant = {}
-                           ORDER BY d.id ASC""".format(str(self.base)))
-            parents = map(lambda p: p[0], cur.fetchall())
-            path = '/'.join(parents)
-            return path
+        path = self.get_dir_map().get_path(self.base)
+        if path is None:    # may be created by other process
+            self.dir_map.invalidate()
+            path = self.get_dir_map().get_path(self.base)
+        return path
 
     def get_path_id(self, path: str):
-        path = [p for p in path.split('/') if len(p) > 0 and p != '.']
-        if len(path) == 1:
-            with self._conn:
-                cur = self._conn.cursor()
-                cur.execute("""SELECT id FROM dirs WHERE title = '{}'""".format(path[0]))
-                id = cur.fetchone()['id']
-            return id
-        else:
-            with self._conn:
-                logger.error("Implement path find ({})".format(str(path)))
-                cur = self._conn.cursor()
-                cur.execute("""SELECT id FROM dirs WHERE title = '{}'""".format(path))
-                id = cur.fetchone()['id']
-            return id
+        """None if there's no such dir"""
+        dir_id = self.get_dir_map().get_id(path)
+        if dir_id is None:  # may be created by other process
+            self.dir_map.invalidate()
+            dir_id = self.get_dir_map().get_id(path)
+        return dir_id
 
     def root(self):
         self.chpath(self.root_path)
@@ -253,21 +501,21 @@ class FileManager(ManagerInterface):
         if self.base == self.root_path:
             return
         else:
-            with self._conn:
-                cur = self._conn.cursor()
-                cur.execute("""SELECT dirs_path.ancestor
-                               FROM dirs_path
-                               WHERE dirs_path.descendant == {}
-                               AND direct = 1""".format(str(self.base)))
-                parent = cur.fetchone()[0]
-                self.chpath(parent)
-                return self._bases.pop()
+            self.chpath(self.dir_map.get_parent(self.base))
+            return self._bases.pop()
 
     def chpath(self, path):
         self._bases.append(self.base)
         self.base = path
 
     def get_items(self):
+        self.get_dir_map()      # reloaded only if dirs were changed
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            backend.update_statuses()
+            dirs = [DirItem(dir_id, {'title': title, 'size': size})
+                    for dir_id, title, size in snapshot.subdirs(self.base)]
+            return dirs + [self.snapshot_item(snapshot, i) for i in snapshot.dir_rows(self.base)]
         self.fetch_items()
         return [DirItem(dir[0], dir) for dir in self._dirs] + super().get_items()
 
@@ -277,40 +525,73 @@ class FileManager(ManagerInterface):
             cur.execute("""SELECT d.*
                            FROM dirs_path AS dp
                            LEFT JOIN dirs AS d ON dp.descendant = d.id
-                           WHERE dp.direct = 1 and dp.ancestor = {}""".format(str(self.base)))
+                           WHERE dp.direct = 1 and dp.ancestor = ?
+                           ORDER BY d.title""", (self.base,))
             self._dirs = cur.fetchall()
-            cur.execute("""SELECT *
-                           FROM notes
-                           WHERE dir_id = {}""".format(self.base))
+            sql, args = self.notes_query()
+            cur.execute(self.order_sql(sql), args)
             self._notes = cur.fetchall()
 
+    def notes_query(self):
+        return """SELECT *
+                  FROM notes
+                  WHERE dir_id = ?""", (self.base,)
+
+
+class PeriodManagerInterface(CategoryManagerInterface):
+    """ Categories are periods of time (see core.period_bounds), notes of
+    period are selected by indexed range scan of pub_ts
+    """
+    sql = """SELECT n.*
+             FROM notes AS n
+             WHERE n.pub_ts >= ? AND n.pub_ts < ?"""
+    period_format = None    # strftime format of period
+    category_sql = """SELECT strftime('{}', n.pub_ts, 'unixepoch', 'localtime') AS title, COUNT(*) AS size
+                      FROM notes AS n
+                      WHERE n.pub_ts IS NOT NULL
+                      GROUP BY 1
+                      ORDER BY 1 DESC"""
+
+    def get_category_sql(self):
+        return self.category_sql.format(self.period_format)
+
+    def notes_query(self):
+        return self.get_sql(), period_bounds(self.base)
+
 
-class MonthManager(CategoryManagerInterface):
+class MonthManager(PeriodManagerInterface):
    key = 'm'
-   sql = """SELECT n.*
-            FROM notes AS n
-            WHERE n.pub_date LIKE '{}' || '%'"""
-   category_sql = """SELECT d.months AS title, count(d.months) AS size
-                     FROM notes AS n
-                     JOIN (SELECT DISTINCT strftime('%Y-%m', substr(n.pub_date, 1, 20)) AS months
-                           FROM notes AS n) AS d
-                     ON n.pub_date LIKE d.months || '%'
-                     GROUP BY d.months"""
+   period_format = '%Y-%m'
    category_class = MonthItem
 
 
+class CalendarManager(PeriodManagerInterface):
+    """ Notes by day, week or year. Also shows arbitrary ranges of days """
+    key = 'C'
+    scales = {'day': '%Y-%m-%d', 'week': '%Y-W%W', 'year': '%Y'}
+    category_class = PeriodItem
+
+    def __init__(self):
+        super().__init__()
+        self.set_scale('week')
+
+    def set_scale(self, scale: str):
+        self.period_format = self.scales[scale]
+        self.root()
+
+
 class TagManager(CategoryManagerInterface):
     key = 't'
     sql = """SELECT n.*
              FROM notes AS n
              JOIN note_tags AS nt ON (nt.note_id = n.id)
              JOIN tags as t ON (nt.tag_id = t.id)
-             WHERE t.id = {}"""
-    category_sql = """SELECT t.id, t.title, COUNT(t.title) AS size
+             WHERE t.id = ?"""
+    category_sql = """SELECT t.id, t.title, s.size, s.latest_ts, s.favorites
                       FROM tags AS t
-                      JOIN note_tags AS nt
-                      ON (t.id = nt.tag_id)
-                      GROUP BY t.title"""
+                      JOIN tag_stats AS s ON (s.tag_id = t.id)
+                      WHERE s.size > 0
+                      ORDER BY t.title DESC"""
     category_class = TagItem
 
 
@@ -324,9 +605,16 @@ class ManagerHub:
         self.managers = self._get_builtin_managers() # {'tag': TagManager}
 
         for name, klass in self.managers.items():
+            self.manager_names[name] = klass()
+            if profiling_enabled():
+                manager = self.manager_names[name]
+                manager.get_items = profiled(name + ' items')(manager.get_items)
+                manager.get_paged_items = profiled(name + ' items')(manager.get_paged_items)
+                manager.iter_items = profiled_iter(name + ' items')(manager.iter_items)
+            if klass.key is None:     # switched only by commands
+                continue
             if klass.key in self.manager_keys:
                 logger.warning("Key {} was already assigned to {}".format(klass.key, str(self.manager_keys[klass.key])))
-            self.manager_names[name] = klass()
             self.manager_keys[klass.key] = name
         self._active = self.get_default_active()
 
@@ -336,9 +624,16 @@ class ManagerHub:
         event_hub.register('reload', lambda: self.reload())
 
     def reload(self):
-        items = self.get_items()
+        items = self.get_items(paged=True)
         event_hub.trigger(('show', items))
 
+    def cycle_sort(self):
+        """Switch all managers to the next sort mode and reload"""
+        sorts = list(SORTS)
+        ManagerInterface.sort = sorts[(sorts.index(ManagerInterface.sort) + 1) % len(sorts)]
+        self.reload()
+        event_hub.trigger(('print', 'Sorted by ' + ManagerInterface.sort))
+
     @property
     def active(self) -> ManagerInterface:
         return self.manager_names[self._active]
@@ -389,15 +684,27 @@ class ManagerHub:
     def get_path_id(self, path: str):
         return self.manager_names['file'].get_path_id(path)
 
-    def get_items(self) -> list:
+    def fuzzy_find(self, query: str) -> list:
+        """Notes with title or path similar to query, best first"""
+        backend.update_statuses()
+        try:
+            rows = fuzzy_find(self.active._conn, query)
+        except sqlite3.OperationalError:    # DB without trigrams
+            event_hub.trigger(('print', 'Repopulate DB to use fuzzy search'))
+            return []
+        return self.active.make_items(rows)
+
+    def get_items(self, paged=False) -> list:
+        get_items = lambda: self.active.get_paged_items() if paged else self.active.get_items()
         try:
-            items = self.active.get_items()
+            items = get_items()
         except sqlite3.OperationalError:
-            logger.info("It seems DB didn't existed. Try to repopulate.")
-            print("It seems DB didn't existed. Populating... It may take some time.")
-            repopulate_db()
-            items = self.active.get_items()
+            if not ensure_schema():     # schema is current, so DB is broken
+                logger.info("It seems DB is broken. Try to repopulate.")
+                print("It seems DB is broken. Populating... It may take some time.")
+                repopulate_db()
+            items = get_items()
         except EmptyManagerException:
             self.switch_by_name(self._previous)
-            items = self.active.get_items()
+            items = get_items()
         return items
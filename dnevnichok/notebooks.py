@@ -0,0 +1,95 @@
+"""
+Several notebooks, every one with its own notes dir, git repo and cache DB
+(shard). dnev works in one of them at a time (`dnev -n work`, $DNEV_NOTEBOOK
+or the one from [Paths]). Cross-notebook view and search read all shards
+concurrently, one thread with its own connection per shard, and merge notes
+by date. Shards are never attached into one big DB.
+Shard which isn't populated (or is older than dnevnichok) is indexed by
+`dnev -n NAME index` in subprocess, so it gets its own git backend.
+"""
+
+import heapq
+from itertools import islice
+import logging
+import os
+import subprocess
+import sys
+
+from dnevnichok.config import config
+from dnevnichok.core import ShardNoteItem
+from dnevnichok.db import connect, get_connection
+from dnevnichok.grep import grep_items
+from dnevnichok.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Newest first, not commited notes (without pub_ts) last
+SHARD_SQL = """SELECT n.*,
+                      (SELECT GROUP_CONCAT(t.title, ', ')
+                       FROM note_tags AS nt
+                       JOIN tags AS t ON (t.id = nt.tag_id)
+                       WHERE nt.note_id = n.id) AS tag_list
+               FROM notes AS n
+               ORDER BY COALESCE(n.pub_ts, 0) DESC, n.id DESC"""
+
+
+class Shard:
+    def __init__(self, notebook: str):
+        self.notebook = notebook
+        self.notes = config.get_path('notes', notebook)
+        self.db = config.get_path('db', notebook)
+
+    def is_indexed(self) -> bool:
+        from dnevnichok.schema import VERSION, get_version
+        return os.path.exists(self.db) and get_version(get_connection(self.db)) == VERSION
+
+    def index(self) -> subprocess.Popen:
+        """ Populate or upgrade shard by dnev working in its notebook """
+        logger.info("Indexing notebook " + self.notebook)
+        return subprocess.Popen([sys.executable, '-m', 'dnevnichok.cli', '--notebook', self.notebook, 'index'],
+                                stdout=subprocess.DEVNULL)
+
+    def read(self, query=None, limit=None) -> list:
+        """ Notes of shard in merge order, only matching query if it's given """
+        # Limit can't be applied before search
+        sql, args = (SHARD_SQL, ()) if query or limit is None else (SHARD_SQL + " LIMIT ?", (limit,))
+        conn = connect(self.db)     # runs in short-lived thread, so connection isn't shared
+        try:
+            items = [self.make_item(row) for row in conn.execute(sql, args)]
+        finally:
+            conn.close()
+        if query:
+            items = grep_items(items, query)
+            items = items[:limit] if limit is not None else items
+        return items
+
+    def make_item(self, row) -> ShardNoteItem:
+        item = dict(row)
+        item['full_path'] = os.path.normpath(os.path.join(self.notes, row['full_path']))
+        item['notebook'] = self.notebook
+        item['status'] = ''
+        tags = sorted(row['tag_list'].split(', ')) if row['tag_list'] else []
+        return ShardNoteItem(row['id'], item, tags=tags)
+
+
+def get_shards(notebooks=None) -> list:
+    """ Shards of given notebooks (all by default), indexed if needed """
+    shards = [Shard(notebook) for notebook in (notebooks or config.get_notebooks())]
+    indexing = [(shard, shard.index()) for shard in shards if not shard.is_indexed()]
+    for shard, proc in indexing:
+        if proc.wait():
+            logger.error("Can't index notebook {} in {}".format(shard.notebook, shard.notes))
+    return [shard for shard in shards if os.path.exists(shard.db)]
+
+
+@profiled('notebooks')
+def read_notebooks(query=None, limit=None, notebooks=None) -> list:
+    """ Notes of all notebooks newest first, only matching query if it's given """
+    shards = get_shards(notebooks)
+    if not shards:
+        return []
+    from concurrent.futures import ThreadPoolExecutor     # only cross-notebook views need it
+    with ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        results = list(pool.map(lambda shard: shard.read(query, limit), shards))
+    merged = heapq.merge(*results, key=lambda item: (item.pub_ts or 0), reverse=True)
+    return list(islice(merged, limit))
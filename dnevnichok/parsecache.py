@@ -0,0 +1,108 @@
+"""
+Content-addressed cache of parse results, keyed by git blob SHA.
+Lives in its own DB file, so it survives repopulation, branch switching
+and even removal of the index: only blobs never seen before are parsed.
+Size is capped, least recently used entries are evicted.
+"""
+
+import hashlib
+import logging
+import pickle
+import time
+
+from dnevnichok.config import config
+from dnevnichok.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = 64   # MB
+VERSION = 2             # bump when parsed meta gets new fields, older entries are parsed again
+USED_PRECISION = 24 * 3600  # seconds, last use isn't rewritten more often, so hits are read-only
+
+
+def blob_hash(content: bytes) -> str:
+    """ The same SHA as git gives to blob with this content """
+    return hashlib.sha1(b'blob ' + str(len(content)).encode() + b'\0' + content).hexdigest()
+
+
+def strip_doctree(doctree):
+    """ Drop references to parser state, which can't (and needn't) be pickled """
+    doctree.reporter = None
+    doctree.transformer = None
+    doctree.settings.warning_stream = None
+    doctree.settings.record_dependencies = None
+    return doctree
+
+
+class ParseCache:
+    def __init__(self, path=None, max_size=None, keep_doctrees=None):
+        self.path = path if path else config.get_path('parse_cache')
+        self.max_size = max_size if max_size else \
+            int(config.get('Index', 'parse_cache_size', DEFAULT_MAX_SIZE)) * 1024 * 1024
+        self.keep_doctrees = keep_doctrees if keep_doctrees is not None else \
+            config.getboolean('Index', 'cache_doctrees', False)
+        self.hits = self.misses = 0
+        with self._conn:
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS
+                                  parsed(sha TEXT PRIMARY KEY, meta BLOB, doctree BLOB,
+                                  size INTEGER, used REAL)""")
+            self._conn.execute("""CREATE INDEX IF NOT EXISTS
+                                  parsed_used ON parsed(used)""")
+
+    @property
+    def _conn(self):
+        return get_connection(self.path)
+
+    def get(self, sha: str):
+        """ Return (meta, doctree or None) or None if blob wasn't parsed yet """
+        row = self._conn.execute("SELECT meta, doctree, used FROM parsed WHERE sha = ?", (sha,)).fetchone()
+        meta = pickle.loads(row['meta']) if row else None
+        if meta is None or meta.get('version') != VERSION:
+            self.misses += 1
+            return None
+        self.hits += 1
+        now = time.time()
+        if now - (row['used'] or 0) > USED_PRECISION:
+            with self._conn:
+                self._conn.execute("UPDATE parsed SET used = ? WHERE sha = ?", (now, sha))
+        doctree = pickle.loads(row['doctree']) if row['doctree'] else None
+        return meta, doctree
+
+    def put(self, sha: str, meta: dict, doctree=None):
+        meta = dict(meta, version=VERSION)
+        meta_blob = pickle.dumps(meta, pickle.HIGHEST_PROTOCOL)
+        doctree_blob = None
+        if doctree is not None and self.keep_doctrees:
+            try:
+                doctree_blob = pickle.dumps(strip_doctree(doctree), pickle.HIGHEST_PROTOCOL)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                logger.debug("Can't pickle doctree of {}: {}".format(sha, e))
+        size = len(meta_blob) + len(doctree_blob or b'')
+        with self._conn:
+            self._conn.execute("""INSERT OR REPLACE INTO parsed(sha, meta, doctree, size, used)
+                                  VALUES(?, ?, ?, ?, ?)""",
+                               (sha, meta_blob, doctree_blob, size, time.time()))
+
+    def evict(self):
+        """ Remove least recently used entries above size cap """
+        total, stale = 0, []
+        for row in self._conn.execute("SELECT sha, size FROM parsed ORDER BY used DESC"):
+            total += row['size']
+            if total > self.max_size:
+                stale.append((row['sha'],))
+        if stale:
+            with self._conn:
+                self._conn.executemany("DELETE FROM parsed WHERE sha = ?", stale)
+            logger.info("Evicted {} parse results from cache".format(len(stale)))
+        logger.info("Parse cache: {} hits, {} misses".format(self.hits, self.misses))
+        self.hits = self.misses = 0
+
+
+_cache = None
+
+
+def get_parse_cache() -> ParseCache:
+    global _cache
+    if _cache is None:
+        _cache = ParseCache()
+    return _cache
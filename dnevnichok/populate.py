@@ -5,15 +5,21 @@ Module contain one-run procedures and helpers for parse whole library
 """
 
 from collections import OrderedDict
-from docutils.core import publish_doctree
-from docutils.utils import SystemMessage
 import logging
 import os
 from os.path import join, isdir
-import sqlite3
 
 from dnevnichok.backend import GitCommandBackend
 from dnevnichok.config import Config
+from dnevnichok.core import diary_epoch, to_epoch
+from dnevnichok.db import get_connection
+from dnevnichok.events import event_hub
+from dnevnichok.links import get_targets, note_links, register_roles
+from dnevnichok.parsecache import blob_hash, get_parse_cache
+from dnevnichok.profiling import profiled
+from dnevnichok.schema import create_schema
+from dnevnichok.search import note_trigrams
+from dnevnichok.snapshot import snapshot_enabled, write_snapshot
 
 
 try:
@@ -37,6 +43,7 @@ class NoteInfo:
         self.real_title = False
         self.favorite = False
         self.tags = []
+        self.links = []
 
     def set_title(self, title):
         if title:
@@ -55,6 +62,10 @@ class NoteInfo:
     def get_size(self):
         return os.path.getsize(self.path)
 
+    def get_pub_ts(self):
+        """ Not commited diary notes are dated by file name """
+        return to_epoch(self.pub_date) or diary_epoch(self.path)
+
     def __str__(self):
         if self.tags:
             return "\"{}\" with {} in {} {}".format(self.get_title(), ', '.join(self.tags), self.path, self.get_size())
@@ -62,38 +73,73 @@ class NoteInfo:
             return "{} without tags in {}".format(self.get_title(), self.path)
 
 
-def parse_note(path, dir_id):
-    with open(path, 'r') as f:
-        note_info = NoteInfo(dir_id)
-        note_info.path = path
-        note_info.mod_date = repo.get_file_mod_date(path)
-        note_info.pub_date = repo.get_file_pub_date(path)
-
-        dom = publish_doctree(f.read(),
+def parse_doctree(doctree) -> dict:
+    """ Everything we need from doctree: title, tags, favorite and link targets """
+    meta = {'title': '', 'tags': [], 'favorite': False, 'links': get_targets(doctree)}
+    dom = doctree.asdom()
+    meta['title'] = dom.firstChild.getAttribute('title')
+
+    fields = dom.getElementsByTagName('field')
+    for field in fields:
+        if field.getElementsByTagName('field_name')[0].firstChild.nodeValue == 'tags':
+            tags_line = field.getElementsByTagName('field_body')[0].childNodes[0].firstChild.nodeValue
+            meta['tags'] = tags_line.split(', ')
+        if field.getElementsByTagName('field_name')[0].firstChild.nodeValue == 'favorite':
+            meta['favorite'] = True
+    return meta
+
+
+def read_meta(path, blob=None) -> dict:
+    """ Meta of note (see parse_doctree). `blob` is git SHA of file's content
+    if it's already known. Content is parsed only if there's no such blob in
+    parse cache """
+    parse_cache = get_parse_cache()
+    cached = parse_cache.get(blob) if blob else None
+    if cached is None:
+        with open(path, 'rb') as f:
+            content = f.read()
+        blob = blob_hash(content)
+        cached = parse_cache.get(blob)
+    if cached is not None:
+        return cached[0]
+    from docutils.core import publish_doctree   # heavy, so not needed for readers of DB
+    register_roles()
+    doctree = publish_doctree(content.decode('UTF-8'),
                               settings_overrides={'halt_level': 2,
                                                   'traceback': True,
                                                   'syntax_highlight': 'none'
-                                                  }).asdom()
-        note_info.set_title(dom.firstChild.getAttribute('title'))
+                                                  })
+    meta = parse_doctree(doctree)
+    parse_cache.put(blob, meta, doctree)
+    return meta
+
 
-        fields = dom.getElementsByTagName('field')
-        for field in fields:
-            if field.getElementsByTagName('field_name')[0].firstChild.nodeValue == 'tags':
-                tags_line = field.getElementsByTagName('field_body')[0].childNodes[0].firstChild.nodeValue
-                note_info.tags = tags_line.split(', ')
-            if field.getElementsByTagName('field_name')[0].firstChild.nodeValue == 'favorite':
-                note_info.favorite = True
+def parse_note(path, dir_id, blob=None, committed=True):
+    """ Not commited files have no git dates, so git isn't asked about them """
+    note_info = NoteInfo(dir_id)
+    note_info.path = path
+    note_info.mod_date = repo.get_file_mod_date(path) if committed else ''
+    note_info.pub_date = repo.get_file_pub_date(path) if committed else ''
 
-        return note_info
+    meta = read_meta(path, blob)
+    note_info.set_title(meta['title'])
+    note_info.tags = meta['tags']
+    note_info.favorite = meta['favorite']
+    note_info.links = note_links(path, meta['links'])
+    return note_info
 
 
 def pollute_dirs_and_notes(notespath, dbpath):
+    from docutils.utils import SystemMessage
+
     class MutableInt:
         i = 1
         def save(self, i): self.i = i
     root_dir = MutableInt()     # Store last inserted dir (lastrowid polluting by dirs_path's INSERTs
     added_roots = OrderedDict() # Cache for all inserted directories
-    exclude = set(['.git'])
+    export = os.path.relpath(os.path.realpath(config.get_path('export')), os.path.realpath(notespath))
+    # Export dir is skipped only if it is inside notebook, by its own path, not by name
+    excluded_paths = set() if export.split(os.sep)[0] == os.pardir else {join('.', export)}
 
     def add_d(path, cur):
         """ Accepts path to dir and saves all it's parents"""
@@ -134,23 +180,23 @@ def pollute_dirs_and_notes(notespath, dbpath):
                                (parent_id, root_dir.i, direct,))
 
 
-    conn = sqlite3.connect(dbpath)
+    conn = get_connection(dbpath)
     with conn:
         cur = conn.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS
-                       dirs(id INTEGER PRIMARY KEY, title TEXT, size INTEGR)""")
-        cur.execute("""CREATE TABLE IF NOT EXISTS
-                       dirs_path (ancestor INTEGER, descendant INTEGER, direct INTEGER,
-                       PRIMARY KEY (ancestor, descendant))""")
+        create_schema(cur)
 
         os.chdir(notespath)
+        blobs = repo.get_blob_hashes()      # SHAs of changed files are computed from content
+        repo.update_statuses()
+        for path in repo.notes_status:
+            blobs.pop('./' + path, None)
         notes = []
         for root, dirs, files in os.walk('.', topdown=True):
-            dirs[:] = [d for d in dirs if d not in exclude]
+            dirs[:] = [d for d in dirs if d != '.git' and join(root, d) not in excluded_paths]
             add_d(root, cur)
             for f in filter(lambda x: x.endswith('.rst'), files):
                 try:
-                    notes.append(parse_note(join(root, f), root_dir.i))
+                    notes.append(parse_note(join(root, f), root_dir.i, blobs.get(join(root, f))))
                 except UnicodeDecodeError:      # TODO: add error to DB
                     logger.warn("so here is unicode error: " + join(root, f))
                 except SystemMessage:
@@ -160,6 +206,8 @@ def pollute_dirs_and_notes(notespath, dbpath):
 
 
 def get_notes(notespath):
+    from docutils.utils import SystemMessage
+
     notes = []
     for path, subdirs, files in os.walk(notespath):
         for name in (f for f in files if f.endswith(".rst")):
@@ -196,7 +244,7 @@ def populate_db_with_dirs(notespath, dbpath):
     os.chdir(notespath)
     dirs = get_dirs(list_dir('.'))
 
-    conn = sqlite3.connect(dbpath)
+    conn = get_connection(dbpath)
     with conn:
         cur = conn.cursor()
         cur.execute("""CREATE TABLE IF NOT EXISTS
@@ -213,53 +261,100 @@ def populate_db_with_dirs(notespath, dbpath):
                     parent = 1
                 else:
                     parent_dir = full_dir.split('/')[depth-1]
-                    cur.execute("""SELECT id FROM dirs WHERE title = '{}'
-                                   ORDER BY id ASC LIMIT 1""".format(parent_dir))
+                    cur.execute("""SELECT id FROM dirs WHERE title = ?
+                                   ORDER BY id ASC LIMIT 1""", (parent_dir,))
                     parent = cur.fetchone()[0]
                 cur.execute("""INSERT OR IGNORE INTO dirs(title, parent_dir_id)
                                VALUES(?, ?)""", (sub_dir, parent))
 
 
-def populate_db_with_notes(notes, notespath, dbpath):
-    tags_cache = {}
-    conn = sqlite3.connect(dbpath)
-
+def insert_dir(cur, title, parent_id) -> int:
+    """ Add empty dir into dirs and their closure table. Return its id """
+    cur.execute("INSERT INTO dirs(title, size) VALUES(?, 0)", (title,))
+    dir_id = cur.lastrowid
+    cur.execute("""INSERT INTO dirs_path(ancestor, descendant, direct)
+                   VALUES(?, ?, ?)""", (dir_id, dir_id, False))
+    cur.execute("""INSERT INTO dirs_path(ancestor, descendant, direct)
+                   SELECT ancestor, ?, ancestor = ? FROM dirs_path WHERE descendant = ?""",
+                (dir_id, parent_id, parent_id))
+    cur.execute("UPDATE dirs SET size = size + 1 WHERE id = ?", (parent_id,))
+    return dir_id
+
+
+def index_trigrams(cur, note):
+    """ Add already inserted note to fuzzy search index """
+    cur.executemany("INSERT OR IGNORE INTO trigrams(trigram, note_id) VALUES(?, ?)",
+                    ((trigram, note.id) for trigram in note_trigrams(note.get_title(), note.path)))
+
+
+def insert_note(cur, note, tags_cache=None):
+    """ Insert parsed note with its tags and trigrams. Set note.id """
+    tags_cache = tags_cache if tags_cache is not None else {}
+    cur.execute("""INSERT INTO notes(title, real_title, full_path, pub_date, mod_date, size, dir_id, favorite, pub_ts, mod_ts)
+                   VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                   (note.get_title(), note.real_title, note.path, note.pub_date, note.mod_date, note.get_size(), note.dir_id, note.favorite,
+                    note.get_pub_ts(), to_epoch(note.mod_date) or None))
+    note.id = cur.lastrowid
+    index_trigrams(cur, note)
+    for tag in note.tags:
+        if tag not in tags_cache:
+            cur.execute("INSERT OR IGNORE INTO tags(title) VALUES(?)", (tag,))
+            cur.execute("SELECT id FROM tags WHERE title = ?", (tag,))
+            tags_cache[tag] = cur.fetchone()[0]
+        cur.execute("INSERT INTO note_tags(note_id, tag_id) VALUES(?, ?)", (note.id, tags_cache[tag],))
+    cur.executemany("INSERT INTO links(source_id, target_path) VALUES(?, ?)",
+                    ((note.id, target) for target in note.links))
+
+
+def reindex_note(path, dir_id=None):
+    """ Replace DB rows of one note with freshly parsed ones (or just delete
+    them if file is gone). Return (old id, new id), any of them may be None
+    """
+    conn = get_connection(dbpath)
     with conn:
         cur = conn.cursor()
-        cur.execute("""CREATE TABLE IF NOT EXISTS
-                       tags(id INTEGER PRIMARY KEY, title TEXT UNIQUE)""")
+        cur.execute("SELECT id, dir_id FROM notes WHERE full_path = ?", (path,))
+        old = cur.fetchone()
+        if old:     # links and trigrams are deleted by triggers
+            cur.execute("DELETE FROM note_tags WHERE note_id = ?", (old[0],))
+            cur.execute("DELETE FROM notes WHERE id = ?", (old[0],))
+            dir_id = dir_id if dir_id is not None else old[1]
+        if not os.path.exists(path):
+            return (old[0] if old else None), None
+        note = parse_note(path, dir_id)
+        insert_note(cur, note)
+    return (old[0] if old else None), note.id
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS
-                       notes(id INTEGER PRIMARY KEY, title TEXT, real_title INTEGER, full_path TEXT, pub_date TEXT, mod_date TEXT, size INT, dir_id INTEGER, favorite INTEGER,
-                       FOREIGN KEY(dir_id) REFERENCES dirs(id))""")
 
-        cur.execute("""CREATE TABLE IF NOT EXISTS
-                       note_tags(note_id INTEGER, tag_id INTEGER,
-                       FOREIGN KEY(note_id) REFERENCES notes(id), FOREIGN KEY(tag_id) REFERENCES tags(id))""")
+def populate_db_with_notes(notes, notespath, dbpath):
+    tags_cache = {}
+    conn = get_connection(dbpath)
 
+    with conn:
+        cur = conn.cursor()
         for note in notes:
-            cur.execute("""INSERT INTO notes(title, real_title, full_path, pub_date, mod_date, size, dir_id, favorite)
-                           VALUES(?, ?, ?, ?, ?, ?, ?, ?)""",
-                           (note.get_title(), note.real_title, note.path, note.pub_date, note.mod_date, note.get_size(), note.dir_id, note.favorite))
-            note.id = cur.lastrowid
-            for tag in note.tags:
-                cur.execute("INSERT OR IGNORE INTO tags(title) VALUES(?)", (tag,))
-                if tag not in tags_cache:
-                    tags_cache[tag] = cur.lastrowid
-                cur.execute("INSERT INTO note_tags(note_id, tag_id) VALUES(?, ?)", (note.id, tags_cache[tag],))
+            insert_note(cur, note, tags_cache)
 
 
+@profiled('repopulate')
 def repopulate_db():
-    conn = sqlite3.connect(dbpath)
+    conn = get_connection(dbpath)
     with conn:
         cur = conn.cursor()
         cur.execute("DROP TABLE IF EXISTS notes")
         cur.execute("DROP TABLE IF EXISTS tags")
         cur.execute("DROP TABLE IF EXISTS note_tags")
+        cur.execute("DROP TABLE IF EXISTS tag_stats")
         cur.execute("DROP TABLE IF EXISTS dirs_path")
         cur.execute("DROP TABLE IF EXISTS dirs")
+        cur.execute("DROP TABLE IF EXISTS trigrams")
+        cur.execute("DROP TABLE IF EXISTS links")
 
     pollute_dirs_and_notes(notespath, dbpath)
+    event_hub.trigger(('dirs-changed',))
+    get_parse_cache().evict()
+    if snapshot_enabled():
+        write_snapshot(dbpath, config.get_path('snapshot'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,94 @@
+"""
+Rendering of notes for preview pane. Notes are rendered to plain text by
+docutils in background thread, so moving through the list never waits for
+file I/O or parsing. Neighbours of highlighted note are rendered in advance.
+Results are kept in small LRU cache, checked against mtime and size of file.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+
+from dnevnichok.aux import find_nodes
+from dnevnichok.contentcache import get_content_cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_SIZE = 32     # rendered notes
+
+DOCUTILS_SETTINGS = {
+    'halt_level': 5,            # show broken markup as is instead of failing
+    'report_level': 5,
+    'syntax_highlight': 'none',
+}
+
+
+def render_text(content: str) -> str:
+    """ Plain text of note without field lists (tags are shown in info bar) """
+    from docutils import nodes
+    from docutils.core import publish_doctree   # heavy, so only preview thread imports it
+    from dnevnichok.links import register_roles
+
+    register_roles()
+    doctree = publish_doctree(content, settings_overrides=DOCUTILS_SETTINGS)
+    for node in list(find_nodes(doctree, nodes.docinfo)) + list(find_nodes(doctree, nodes.field_list)):
+        node.parent.remove(node)
+    return doctree.astext()
+
+
+def stamp(path: str):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+class Previewer:
+    def __init__(self, cache_size=CACHE_SIZE):
+        self.cache_size = cache_size
+        self._cache = OrderedDict()     # path -> (stamp, text)
+        self._pending = {}              # path -> future
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, path: str):
+        """ Rendered text if it's ready and file didn't change, otherwise None """
+        with self._lock:
+            entry = self._cache.get(path)
+            if entry is None or entry[0] != stamp(path):
+                return None
+            self._cache.move_to_end(path)
+            return entry[1]
+
+    def request(self, paths):
+        """ Render paths in background, the first one first """
+        for path in paths:
+            if path in self._pending or self.get(path) is not None:
+                continue
+            self._pending[path] = self._pool.submit(self._render, path)
+
+    def _render(self, path: str):
+        file_stamp = stamp(path)
+        try:
+            text = render_text(get_content_cache().get(path))
+        except Exception as e:  # preview must not crash the app
+            logger.warning("Can't render {}: {}".format(path, e))
+            text = ''
+        with self._lock:
+            self._cache[path] = (file_stamp, text)
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def pending(self) -> bool:
+        return bool(self._pending)
+
+    def finished(self) -> list:
+        """ Paths rendered since last call """
+        done = [path for path, future in self._pending.items() if future.done()]
+        for path in done:
+            del self._pending[path]
+        return done
@@ -0,0 +1,166 @@
+"""
+Memory profiling mode. Enabled by `[Debug] profile_memory = yes` or
+`dnev --profile-memory` (which sets $DNEV_PROFILE_MEMORY, so it goes to
+subprocesses too). Repopulation, items of managers and search are measured:
+allocations are traced by tracemalloc, RSS is sampled by background thread.
+For every measured call log gets growth and peak of traced memory and RSS,
+number of live NoteInfo and NoteItem objects (they must not outlive their
+lists) and top allocating lines.
+Without profiling mode measured functions cost one check per call.
+"""
+
+from contextlib import contextmanager
+import functools
+import gc
+import logging
+import os
+import resource
+import threading
+import time
+import tracemalloc
+
+from dnevnichok.config import config
+
+logger = logging.getLogger(__name__)
+
+FRAMES = 8          # traceback depth of traced allocations
+SAMPLE_INTERVAL = 0.01  # seconds between RSS samples
+TOP = 10            # allocating lines in report
+MB = 1024 * 1024
+
+_measured = []      # names of measured calls in progress, outermost first
+_peaks = []         # their peaks of traced memory
+
+
+def profiling_enabled() -> bool:
+    return bool(os.environ.get('DNEV_PROFILE_MEMORY')) or \
+        config.getboolean('Debug', 'profile_memory', False)
+
+
+def get_rss() -> int:
+    """ Current RSS in bytes, peak RSS of process where /proc is missing """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024    # KB on Linux
+
+
+class RSSSampler(threading.Thread):
+    """ Peak RSS while measured call runs """
+    def __init__(self):
+        super().__init__(daemon=True)
+        self.peak = get_rss()
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(SAMPLE_INTERVAL):
+            self.peak = max(self.peak, get_rss())
+
+    def stop(self) -> int:
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, get_rss())
+        return self.peak
+
+
+def count_live(*class_names) -> dict:
+    """ Number of live objects of classes with given names """
+    counts = dict.fromkeys(class_names, 0)
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+    return counts
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    ))
+
+
+def report(name, elapsed, before, after, peak, rss_before, rss_peak):
+    top = int(config.get('Debug', 'profile_top', TOP))
+    stats = after.compare_to(before, 'lineno')
+    growth = sum(stat.size_diff for stat in stats)
+    lines = ["Memory of {}: {:+.1f} MB traced (peak {:.1f} MB), RSS {:.1f} MB (peak {:+.1f} MB) in {:.2f} s".format(
+        name, growth / MB, peak / MB, get_rss() / MB, (rss_peak - rss_before) / MB, elapsed)]
+    lines.append("  live: " + ', '.join('{} {}'.format(cls, n) for cls, n in count_live('NoteInfo', 'NoteItem').items()))
+    for stat in sorted(stats, key=lambda stat: abs(stat.size_diff), reverse=True)[:top]:
+        if not stat.size_diff:
+            break
+        frame = stat.traceback[0]
+        lines.append("  {:+9.1f} KB {:+8d} blocks  {}:{}".format(
+            stat.size_diff / 1024, stat.count_diff, frame.filename, frame.lineno))
+    logger.info('\n'.join(lines))
+
+
+@contextmanager
+def measure(name: str):
+    """ Log memory report of the block, if profiling mode is on.
+    Nested block with the same name is a part of outer one """
+    if not profiling_enabled() or name in _measured:
+        yield
+        return
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(FRAMES)
+    if _peaks:      # nested call resets peak, so keep what outer call has reached
+        _peaks[-1] = max(_peaks[-1], tracemalloc.get_traced_memory()[1])
+    _measured.append(name)
+    _peaks.append(0)
+    sampler = RSSSampler()      # started before snapshot, so its allocations aren't reported
+    rss_before = sampler.peak
+    sampler.start()
+    before = take_snapshot()
+    if hasattr(tracemalloc, 'reset_peak'):     # Python 3.9
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        rss_peak = sampler.stop()
+        _measured.pop()
+        peak = max(_peaks.pop(), tracemalloc.get_traced_memory()[1])
+        if _peaks:
+            _peaks[-1] = max(_peaks[-1], peak)
+        report(name, elapsed, before, take_snapshot(), peak, rss_before, rss_peak)
+
+
+def profiled(name: str):
+    """ Decorator version of measure """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with measure(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def measured_iter(name: str, iterable):
+    """ Iterate under measure, so lazy results (e.g. of dnev query) are
+    measured while they are consumed. Report is written when iteration is
+    finished or abandoned """
+    if not profiling_enabled():
+        return iterable
+    return _measured_iter(name, iterable)
+
+
+def _measured_iter(name, iterable):
+    with measure(name):
+        yield from iterable
+
+
+def profiled_iter(name: str):
+    """ profiled for functions returning iterators """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return measured_iter(name, func(*args, **kwargs))
+        return wrapper
+    return decorator
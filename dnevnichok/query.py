@@ -0,0 +1,86 @@
+"""
+Queries of notes index shared by headless CLI and daemon
+"""
+
+from itertools import islice
+import logging
+
+from dnevnichok.core import ShardNoteItem, period_bounds
+from dnevnichok.managers import EmptyManagerException, ManagerInterface, SORTS
+from dnevnichok.profiling import measured_iter
+from dnevnichok.search import matches
+from dnevnichok.tagquery import TagQueryError
+
+logger = logging.getLogger(__name__)
+
+
+class QueryError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def item_to_dict(item) -> dict:
+    result = {'id': item.id,
+              'title': item.title,
+              'path': item.get_path(),
+              'pub_date': item.pub_date,
+              'mod_date': item.mod_date,
+              'size': item.size,
+              'favorite': bool(item.favorite),
+              'tags': item.tags,
+              'status': item.status}
+    if isinstance(item, ShardNoteItem):
+        result['notebook'] = item.notebook
+    return result
+
+
+def query_items(manager_hub, args):
+    """ Pick manager by args, put it into required state and return generator of its items """
+    if args.sort not in SORTS:
+        raise QueryError("Unknown sort: " + args.sort)
+    ManagerInterface.sort = args.sort
+    if args.tag:
+        manager = manager_hub.manager_names['tag']
+        row = manager._conn.execute("SELECT id FROM tags WHERE title = ?", (args.tag,)).fetchone()
+        if row is None:
+            raise QueryError("Unknown tag: " + args.tag)
+        manager.chpath(row[0])
+    elif args.month:
+        manager = manager_hub.manager_names['month']
+        manager.chpath(args.month)
+    elif args.period:
+        manager = manager_hub.manager_names['calendar']
+        try:
+            period_bounds(args.period)
+        except ValueError:
+            raise QueryError("Bad period: " + args.period)
+        manager.chpath(args.period)
+    elif args.dir:
+        manager = manager_hub.manager_names['file']
+        dir_id = manager_hub.get_path_id(args.dir)
+        if dir_id is None:
+            raise QueryError("Unknown directory: " + args.dir)
+        manager.chpath(dir_id)
+    elif args.tags:
+        manager = manager_hub.manager_names['tagquery']
+        try:
+            manager.set_query(args.tags)
+        except TagQueryError as e:
+            raise QueryError(e.message)
+    else:
+        manager = manager_hub.manager_names[args.manager]     # one of QUERY_MANAGERS of cli
+
+    try:
+        items = manager.iter_items()
+    except EmptyManagerException:
+        raise QueryError("Query needs --tag, --dir or other state of manager")
+    if args.search:
+        items = measured_iter('search', (item for item in items if matches(item, args.search)))
+    if args.limit:
+        items = islice(items, args.limit)
+    return items
+
+
+def is_populated(conn) -> bool:
+    return conn.execute("""SELECT 1 FROM sqlite_master
+                           WHERE type = 'table' AND name = 'notes'""").fetchone() is not None
@@ -0,0 +1,310 @@
+"""
+Schema of cache DB and migrations between its versions.
+Version is kept in PRAGMA user_version. Every migration upgrades DB by one
+version in place: adds tables, columns and indexes and fills only data which
+is new, so upgrade of dnevnichok doesn't mean parsing of whole notebook.
+DB is repopulated only if it can't be migrated (no DB yet, newer version,
+failed migration).
+Migrations must be idempotent: create_schema is always the newest schema and
+DBs before versioning are brought to it at once.
+"""
+
+import logging
+import os
+import time
+
+from dnevnichok.config import config
+from dnevnichok.core import diary_epoch, to_epoch
+from dnevnichok.db import get_connection
+from dnevnichok.search import note_trigrams
+
+logger = logging.getLogger(__name__)
+
+
+class RebuildNeeded(Exception):
+    pass
+
+
+def create_schema(cur):
+    """ Everything which doesn't exist yet, in the newest version """
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   dirs(id INTEGER PRIMARY KEY, title TEXT, size INTEGR)""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   dirs_path (ancestor INTEGER, descendant INTEGER, direct INTEGER,
+                   PRIMARY KEY (ancestor, descendant))""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   tags(id INTEGER PRIMARY KEY, title TEXT UNIQUE)""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   notes(id INTEGER PRIMARY KEY, title TEXT, real_title INTEGER, full_path TEXT, pub_date TEXT, mod_date TEXT, size INT, dir_id INTEGER, favorite INTEGER,
+                   pub_ts INTEGER, mod_ts INTEGER,
+                   FOREIGN KEY(dir_id) REFERENCES dirs(id))""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   note_tags(note_id INTEGER, tag_id INTEGER,
+                   FOREIGN KEY(note_id) REFERENCES notes(id), FOREIGN KEY(tag_id) REFERENCES tags(id))""")
+
+    # Sort modes of managers. Expressions must be the same as in managers.SORTS,
+    # date is sorted by notes_pub_ts below (rowid, i.e. id, is in every index)
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_title ON notes(title COLLATE NOCASE, id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_size ON notes(size, id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_full_path ON notes(full_path)""")
+    # Range scans of calendar
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_pub_ts ON notes(pub_ts)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_mod_ts ON notes(mod_ts)""")
+    # Files manager
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_dir_id ON notes(dir_id)""")
+
+    # Posting lists for fuzzy search
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   trigrams(trigram TEXT, note_id INTEGER,
+                   PRIMARY KEY (trigram, note_id)) WITHOUT ROWID""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   trigrams_note_id ON trigrams(note_id)""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   notes_delete_trigrams AFTER DELETE ON notes
+                   BEGIN DELETE FROM trigrams WHERE note_id = old.id; END""")
+
+    # References between notes, by path of target, so it may be not indexed yet
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   links(source_id INTEGER, target_path TEXT,
+                   FOREIGN KEY(source_id) REFERENCES notes(id))""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   links_source_id ON links(source_id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   links_target_path ON links(target_path, source_id)""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   notes_delete_links AFTER DELETE ON notes
+                   BEGIN DELETE FROM links WHERE source_id = old.id; END""")
+
+    # Tags of deleted notes and notes of deleted tags go too
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   note_tags_note_id ON note_tags(note_id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   note_tags_tag_id ON note_tags(tag_id, note_id)""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   notes_delete_tags BEFORE DELETE ON notes
+                   BEGIN DELETE FROM note_tags WHERE note_id = old.id; END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   tags_delete_notes BEFORE DELETE ON tags
+                   BEGIN DELETE FROM note_tags WHERE tag_id = old.id;
+                         DELETE FROM tag_stats WHERE tag_id = old.id; END""")
+
+    # Materialized per tag statistics for tag list, kept by triggers on note_tags.
+    # Notes are replaced, not updated, but favorite and date are followed anyway
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   tag_stats(tag_id INTEGER PRIMARY KEY, size INTEGER, latest_ts INTEGER, favorites INTEGER,
+                   FOREIGN KEY(tag_id) REFERENCES tags(id))""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   note_tags_insert_stats AFTER INSERT ON note_tags
+                   BEGIN
+                       INSERT OR IGNORE INTO tag_stats(tag_id, size, latest_ts, favorites)
+                       VALUES(new.tag_id, 0, NULL, 0);
+                       UPDATE tag_stats
+                       SET size = size + 1,
+                           latest_ts = MAX(COALESCE(latest_ts, 0),
+                                           COALESCE((SELECT pub_ts FROM notes WHERE id = new.note_id), 0)),
+                           favorites = favorites + COALESCE((SELECT favorite FROM notes WHERE id = new.note_id), 0)
+                       WHERE tag_id = new.tag_id;
+                   END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   note_tags_delete_stats AFTER DELETE ON note_tags
+                   BEGIN
+                       UPDATE tag_stats
+                       SET size = size - 1,
+                           latest_ts = (SELECT MAX(n.pub_ts) FROM note_tags AS nt
+                                        JOIN notes AS n ON (n.id = nt.note_id)
+                                        WHERE nt.tag_id = old.tag_id),
+                           favorites = favorites - COALESCE((SELECT favorite FROM notes WHERE id = old.note_id), 0)
+                       WHERE tag_id = old.tag_id;
+                   END""")
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                   notes_update_stats AFTER UPDATE OF favorite, pub_ts ON notes
+                   BEGIN
+                       UPDATE tag_stats
+                       SET favorites = favorites - COALESCE(old.favorite, 0) + COALESCE(new.favorite, 0),
+                           latest_ts = (SELECT MAX(n.pub_ts) FROM note_tags AS nt
+                                        JOIN notes AS n ON (n.id = nt.note_id)
+                                        WHERE nt.tag_id = tag_stats.tag_id)
+                       WHERE tag_id IN (SELECT tag_id FROM note_tags WHERE note_id = new.id);
+                   END""")
+
+    # Checkpoints of interrupted imports, see importer
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   import_state(source TEXT, dest TEXT, last_path TEXT, imported INTEGER,
+                   PRIMARY KEY (source, dest))""")
+
+    create_index_version(cur)
+
+    cur.execute("PRAGMA user_version = {}".format(VERSION))
+
+
+def create_index_version(cur):
+    """ Counter of changes of notes, tags and dirs, kept by triggers. Snapshot
+    is valid while it's the same, other writes to DB don't touch it.
+    It isn't dropped on repopulation, so it never goes back """
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   index_version(version INTEGER)""")
+    cur.execute("""INSERT INTO index_version(version)
+                   SELECT 0 WHERE NOT EXISTS (SELECT 1 FROM index_version)""")
+    for table in ('notes', 'tags', 'dirs'):
+        for event in ('INSERT', 'UPDATE', 'DELETE'):
+            cur.execute("""CREATE TRIGGER IF NOT EXISTS
+                           {0}_{1}_version AFTER {2} ON {0}
+                           BEGIN UPDATE index_version SET version = version + 1; END""".format(
+                               table, event.lower(), event))
+
+
+def recount_tag_stats(cur):
+    """ Fill tag_stats from scratch, afterwards triggers keep it """
+    cur.execute("DELETE FROM tag_stats")
+    cur.execute("""INSERT INTO tag_stats(tag_id, size, latest_ts, favorites)
+                   SELECT nt.tag_id, COUNT(*), MAX(n.pub_ts), TOTAL(n.favorite)
+                   FROM note_tags AS nt
+                   JOIN notes AS n ON (n.id = nt.note_id)
+                   GROUP BY nt.tag_id""")
+
+
+def get_tables(cur) -> set:
+    return {name for name, in cur.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+
+def fill_epochs(cur):
+    cur.executemany("UPDATE notes SET pub_ts = ?, mod_ts = ? WHERE id = ?",
+                    [(to_epoch(pub_date) or diary_epoch(path), to_epoch(mod_date) or None, note_id)
+                     for note_id, path, pub_date, mod_date
+                     in cur.execute("SELECT id, full_path, pub_date, mod_date FROM notes").fetchall()])
+
+
+def fill_trigrams(cur):
+    for note_id, title, path in cur.execute("SELECT id, title, full_path FROM notes").fetchall():
+        cur.executemany("INSERT OR IGNORE INTO trigrams(trigram, note_id) VALUES(?, ?)",
+                        ((trigram, note_id) for trigram in note_trigrams(title, path)))
+
+
+def fill_links(cur):
+    """ Link targets aren't in DB, so notes are read again (mostly from parse cache) """
+    from docutils.utils import SystemMessage
+    from dnevnichok.links import note_links
+    from dnevnichok.populate import read_meta
+
+    notespath = config.get_path('notes')
+    for note_id, path in cur.execute("SELECT id, full_path FROM notes").fetchall():
+        try:
+            meta = read_meta(os.path.join(notespath, path))
+        except (OSError, UnicodeDecodeError, SystemMessage) as e:
+            logger.warning("Can't read links of {}: {}".format(path, e))
+            continue
+        cur.executemany("INSERT INTO links(source_id, target_path) VALUES(?, ?)",
+                        ((note_id, target) for target in note_links(path, meta['links'])))
+
+
+def migrate_legacy(cur):
+    """ Any DB written before versioning: columns, tables, indexes and triggers
+    were added one by one, so add what is missing and fill only that """
+    tables = get_tables(cur)
+    if not {'dirs', 'dirs_path', 'notes', 'tags', 'note_tags'} <= tables:
+        raise RebuildNeeded("DB isn't populated")
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(notes)")}
+    if not {'pub_ts', 'mod_ts'} <= columns:
+        for column in {'pub_ts', 'mod_ts'} - columns:
+            cur.execute("ALTER TABLE notes ADD COLUMN {} INTEGER".format(column))
+        fill_epochs(cur)
+    create_schema(cur)
+    if 'trigrams' not in tables:
+        fill_trigrams(cur)
+    if 'links' not in tables:
+        fill_links(cur)
+    recount_tag_stats(cur)      # may be created just now or stale after older dnevnichok
+
+
+def add_dir_index(cur):
+    """ Files manager selects notes of directory """
+    cur.execute("""CREATE INDEX IF NOT EXISTS
+                   notes_dir_id ON notes(dir_id)""")
+
+
+def add_import_state(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS
+                   import_state(source TEXT, dest TEXT, last_path TEXT, imported INTEGER,
+                   PRIMARY KEY (source, dest))""")
+
+
+def drop_history(cur):
+    """ History index moved into its own DB file """
+    for table in ('commits', 'file_commits', 'history_head'):
+        cur.execute("DROP TABLE IF EXISTS " + table)
+
+
+def sort_by_pub_ts(cur):
+    """ Date sort uses plain pub_ts column and its index """
+    cur.execute("DROP INDEX IF EXISTS notes_pub_date")
+
+
+MIGRATIONS = (      # MIGRATIONS[i] upgrades DB of version i to i + 1
+    migrate_legacy,
+    add_dir_index,
+    add_import_state,
+    create_index_version,
+    drop_history,
+    sort_by_pub_ts,
+)
+VERSION = len(MIGRATIONS)
+
+
+def get_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def upgrade(conn) -> bool:
+    """ Run missing migrations, each in its own transaction.
+    False if DB can't be upgraded and must be repopulated """
+    version = get_version(conn)
+    if version > VERSION:
+        logger.warning("DB schema {} is newer than {} of this dnevnichok".format(version, VERSION))
+        return False
+    for version in range(version, VERSION):
+        migration = MIGRATIONS[version]
+        started = time.perf_counter()
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")    # DDL doesn't start transaction implicitly
+            migration(cur)
+            cur.execute("PRAGMA user_version = {}".format(version + 1))
+            conn.commit()
+        except RebuildNeeded as e:
+            conn.rollback()
+            logger.info("Can't migrate DB: {}".format(e))
+            return False
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration {} failed".format(migration.__name__))
+            return False
+        logger.info("Migrated DB to schema {} by {} in {:.0f} ms".format(
+            version + 1, migration.__name__, (time.perf_counter() - started) * 1000))
+    return True
+
+
+def ensure_schema() -> bool:
+    """ Bring DB to current version, repopulate as the last resort.
+    True if DB was changed """
+    from dnevnichok.snapshot import snapshot_enabled, write_snapshot
+
+    conn = get_connection()
+    if get_version(conn) == VERSION:
+        return False
+    if upgrade(conn):
+        if snapshot_enabled():
+            write_snapshot(config.get_path('db'), config.get_path('snapshot'))
+    else:
+        from dnevnichok.populate import repopulate_db
+        logger.info("Repopulating DB")
+        repopulate_db()
+    return True
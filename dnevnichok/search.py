@@ -0,0 +1,103 @@
+"""
+Search over items shown by managers
+"""
+
+import logging
+
+from dnevnichok.grep import content_matches, grep_items, name_matches
+from dnevnichok.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+FUZZY_LIMIT = 50            # how many candidates take from trigram posting lists
+FUZZY_THRESHOLD = 0.3       # part of query trigrams candidate must have
+
+
+def matches(item, query: str) -> bool:
+    """ Query with upper-case letters is case-sensitive """
+    return name_matches(item, query) or content_matches(item, query)
+
+
+@profiled('search')
+def filter_items(items, query: str, cancelled=None, on_partial=None):
+    """ Return items matching query or None if `cancelled` callback said
+    that nobody waits for the result anymore (e.g. user pressed another key).
+    on_partial(found so far) is called while content of notes is scanned
+    """
+    return grep_items(list(items), query, cancelled, on_partial)
+
+
+class IncrementalFilter:
+    """
+    Search-as-you-type. Remembers results for every prefix of current query,
+    so extended query narrows previous result set instead of scanning
+    all items and erased one is answered from cache.
+    It is safe because everything matching "abc" also matches "ab" (and
+    case-sensitive match is also case-insensitive one)
+    """
+    def __init__(self, items, on_partial=None):
+        self._results = [('', list(items))]
+        self.on_partial = on_partial
+
+    def filter(self, query: str, cancelled=None):
+        while not query.startswith(self._results[-1][0]):
+            self._results.pop()     # '' is prefix of everything, so it stays
+        base_query, base = self._results[-1]
+        if base_query == query:
+            return base
+        found = filter_items(base, query, cancelled, self.on_partial)
+        if found is not None:
+            self._results.append((query, found))
+        else:
+            logger.debug("Search for {} cancelled".format(query))
+        return found
+
+
+def trigrams(text: str) -> set:
+    """ Set of lower-cased trigrams. Words are padded with spaces, so
+    beginning of words weighs more """
+    text = '  ' + ' '.join(text.lower().split()) + ' '
+    return {text[i:i+3] for i in range(len(text) - 2)}
+
+
+def note_trigrams(title: str, path: str) -> set:
+    """ What is indexed for every note: title and path without extension """
+    path = path[2:] if path.startswith('./') else path
+    path = path[:-4] if path.endswith('.rst') else path
+    return trigrams(title) | trigrams(path.replace('/', ' '))
+
+
+def similarity(query_trigrams: set, text: str) -> float:
+    text_trigrams = trigrams(text)
+    common = len(query_trigrams & text_trigrams)
+    return common / len(query_trigrams | text_trigrams)
+
+
+def fuzzy_find(conn, query: str, limit=FUZZY_LIMIT) -> list:
+    """
+    Typo-tolerant search by title and path. Candidates are counted from
+    `trigrams` posting lists, so notes sharing nothing with query are never
+    touched. Return notes rows, best first
+    """
+    query_trigrams = trigrams(query)
+    placeholders = ', '.join('?' for _ in query_trigrams)
+    min_hits = max(1, int(len(query_trigrams) * FUZZY_THRESHOLD))
+    cur = conn.cursor()
+    cur.execute("""SELECT n.*, c.hits
+                   FROM (SELECT note_id, COUNT(*) AS hits
+                         FROM trigrams
+                         WHERE trigram IN ({})
+                         GROUP BY note_id
+                         HAVING hits >= ?
+                         ORDER BY hits DESC
+                         LIMIT ?) AS c
+                   JOIN notes AS n ON (n.id = c.note_id)""".format(placeholders),
+                list(query_trigrams) + [min_hits, limit])
+
+    def rank(row):
+        # part of query found, then how close whole title or file name is
+        closeness = max(similarity(query_trigrams, row['title']),
+                        similarity(query_trigrams, row['full_path'].split('/')[-1][:-4]))
+        return row['hits'] / len(query_trigrams) + closeness
+
+    return sorted(cur.fetchall(), key=rank, reverse=True)
@@ -0,0 +1,230 @@
+"""
+Compact read-only snapshot of the index for instant cold start.
+Written at the end of populate, opened with mmap. Columns are fixed-width
+arrays (memoryviews over the mapped file), titles, paths and tags live in one
+string table, so nothing is read or built until a row is actually shown.
+Notes are stored in default ("All", by date) order.
+Snapshot is valid only while notes, tags and dirs are the same as at the time
+of writing (see schema.create_index_version), after their changes managers
+fall back to SQLite until snapshot is rewritten. Daemon rewrites it after
+reindexing, dnev after its own new and delete.
+"""
+
+from array import array
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+
+from dnevnichok.config import config
+from dnevnichok.core import from_epoch, to_epoch
+from dnevnichok.db import get_connection
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'DNVS'
+VERSION = 4
+FAVORITE, REAL_TITLE = 1, 2     # flags
+ALIGN = 8
+
+# name, array typecode
+COLUMNS = (('id', 'i'), ('dir_id', 'i'), ('pub_date', 'q'), ('mod_date', 'q'), ('size', 'q'),
+           ('flags', 'B'), ('title', 'I'), ('path', 'I'), ('tags', 'I'), ('dir_order', 'i'),
+           ('dirs_id', 'i'), ('dirs_parent', 'i'), ('dirs_size', 'i'), ('dirs_title', 'I'),
+           ('strings', 'B'))
+# magic, version, notes count, dirs count, index version, then offset and length of every column
+HEADER = struct.Struct('=4sIII' + 'q' + 'QQ' * len(COLUMNS))
+
+_writing = threading.Lock()
+
+
+def index_version(conn) -> int:
+    """ Changes on every write to notes, tags and dirs """
+    return conn.execute("SELECT version FROM index_version").fetchone()[0]
+
+
+def write_snapshot(dbpath, path):
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    strings = {column: bytearray() for column in ('title', 'path', 'tags', 'dirs_title')}
+
+    def add_string(column, text):
+        """ Strings of every column are contiguous, so end of string is start of next one """
+        columns[column].append(len(strings[column]))
+        strings[column].extend((text or '').encode())
+
+    conn = get_connection(dbpath)
+    cur = conn.cursor()
+    cur.execute("BEGIN")    # everything below is read from one state of DB
+    version = index_version(conn)
+    tags = {}
+    cur.execute("""SELECT nt.note_id, t.title
+                   FROM note_tags AS nt
+                   JOIN tags AS t ON (t.id = nt.tag_id)""")
+    for note_id, tag in cur.fetchall():
+        tags.setdefault(note_id, []).append(tag)
+
+    # The same order as managers.SORTS['date']
+    cur.execute("""SELECT id, dir_id, pub_date, mod_date, size, favorite, real_title, title, full_path
+                   FROM notes
+                   ORDER BY pub_ts DESC, id DESC""")
+    for note_id, dir_id, pub_date, mod_date, size, favorite, real_title, title, full_path in cur:
+        columns['id'].append(note_id)
+        columns['dir_id'].append(dir_id or 0)
+        columns['pub_date'].append(to_epoch(pub_date))
+        columns['mod_date'].append(to_epoch(mod_date))
+        columns['size'].append(size or 0)
+        columns['flags'].append((FAVORITE if favorite else 0) | (REAL_TITLE if real_title else 0))
+        add_string('title', title)
+        add_string('path', full_path)
+        add_string('tags', ', '.join(sorted(tags.get(note_id, []))))
+    count = len(columns['id'])
+    # stable sort keeps date order inside of directory
+    columns['dir_order'].extend(sorted(range(count), key=lambda i: columns['dir_id'][i]))
+
+    cur.execute("""SELECT d.id, COALESCE(dp.ancestor, 0), d.size, d.title
+                   FROM dirs AS d
+                   LEFT JOIN dirs_path AS dp ON (dp.descendant = d.id AND dp.direct = 1)
+                   ORDER BY COALESCE(dp.ancestor, 0), d.title""")
+    for dir_id, parent, size, title in cur:
+        columns['dirs_id'].append(dir_id)
+        columns['dirs_parent'].append(parent)
+        columns['dirs_size'].append(size or 0)
+        add_string('dirs_title', title)
+    dirs_count = len(columns['dirs_id'])
+    conn.rollback()     # nothing was written
+
+    base = 0    # join string tables into one
+    for column, column_strings in strings.items():
+        columns[column].append(len(column_strings))
+        columns[column] = array('I', (offset + base for offset in columns[column]))
+        columns['strings'].extend(column_strings)
+        base += len(column_strings)
+    sections = []
+    offset = HEADER.size
+    for name, _ in COLUMNS:
+        offset += -offset % ALIGN
+        length = len(columns[name]) * columns[name].itemsize
+        sections.append((offset, length))
+        offset += length
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION, count, dirs_count, version,
+                            *(n for section in sections for n in section)))
+        for (name, _), (offset, _) in zip(COLUMNS, sections):
+            f.write(bytes(offset - f.tell()))
+            columns[name].tofile(f)
+    os.replace(tmp_path, path)     # readers never see half-written snapshot
+    logger.info("Snapshot of {} notes written to {}".format(count, path))
+
+
+def refresh_snapshot(background=False):
+    """ Rewrite snapshot if it's enabled and notes were changed since it was
+    written. In background thread of its own unless it is already running """
+    if not snapshot_enabled():
+        return
+    if background:
+        threading.Thread(target=refresh_snapshot, daemon=True).start()
+        return
+    if not _writing.acquire(blocking=False):
+        return
+    try:
+        if open_snapshot() is None:
+            write_snapshot(config.get_path('db'), config.get_path('snapshot'))
+    except (OSError, sqlite3.Error) as e:
+        logger.warning("Can't refresh snapshot: {}".format(e))
+    finally:
+        _writing.release()
+
+
+class Snapshot:
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = HEADER.unpack_from(self._mmap)
+        magic, version, self.count, self.dirs_count = header[:4]
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Unknown snapshot format")
+        self.version = header[4]
+        view = memoryview(self._mmap)
+        sections = header[5:]
+        for i, (name, typecode) in enumerate(COLUMNS):
+            offset, length = sections[2*i], sections[2*i+1]
+            setattr(self, name, view[offset:offset+length].cast(typecode))
+
+    def __len__(self):
+        return self.count
+
+    def _string(self, offsets, i) -> str:
+        return bytes(self.strings[offsets[i]:offsets[i+1]]).decode()
+
+    def row(self, i) -> dict:
+        """ Note in position i as notes table row """
+        flags = self.flags[i]
+        return {'id': self.id[i],
+                'title': self._string(self.title, i),
+                'real_title': bool(flags & REAL_TITLE),
+                'full_path': self._string(self.path, i),
+                'pub_date': from_epoch(self.pub_date[i]),
+                'mod_date': from_epoch(self.mod_date[i]),
+                'size': self.size[i],
+                'dir_id': self.dir_id[i],
+                'favorite': bool(flags & FAVORITE)}
+
+    def get_tags(self, i) -> list:
+        tags = self._string(self.tags, i)
+        return tags.split(', ') if tags else []
+
+    def _bisect(self, length, key, value) -> int:
+        """ First position in [0, length) where key(position) >= value """
+        lo, hi = 0, length
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if key(mid) < value:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def dir_rows(self, dir_id) -> memoryview:
+        """ Positions of notes in directory, by date """
+        key = lambda k: self.dir_id[self.dir_order[k]]
+        start = self._bisect(self.count, key, dir_id)
+        end = self._bisect(self.count, key, dir_id + 1)
+        return self.dir_order[start:end]
+
+    def subdirs(self, dir_id) -> list:
+        """ (id, title, size) of direct subdirectories, by title """
+        start = self._bisect(self.dirs_count, lambda k: self.dirs_parent[k], dir_id)
+        end = self._bisect(self.dirs_count, lambda k: self.dirs_parent[k], dir_id + 1)
+        return [(self.dirs_id[k], self._string(self.dirs_title, k), self.dirs_size[k])
+                for k in range(start, end)]
+
+
+def snapshot_enabled() -> bool:
+    return config.getboolean('Index', 'snapshot', True)
+
+
+_opened = None
+
+
+def open_snapshot(path=None, dbpath=None):
+    """ Return Snapshot if it's enabled and matches DB, otherwise None """
+    global _opened
+    path = path if path else config.get_path('snapshot')
+    dbpath = dbpath if dbpath else config.get_path('db')
+    if not snapshot_enabled():
+        return None
+    try:
+        snapshot_mtime = os.stat(path).st_mtime_ns
+        if _opened is None or _opened[:2] != (path, snapshot_mtime):
+            _opened = path, snapshot_mtime, Snapshot(path)
+        version = index_version(get_connection(dbpath))
+    except (OSError, ValueError, struct.error, sqlite3.Error) as e:
+        logger.debug("No snapshot: {}".format(e))
+        _opened = None
+        return None
+    snapshot = _opened[2]
+    return snapshot if snapshot.version == version else None    # or notes were changed after snapshot
@@ -0,0 +1,173 @@
+"""
+Boolean queries over tags like `work & !archived | meeting`.
+Every tag is kept in memory as bitmap of note ids (python int, bit N is note
+with id N), so query is just a few bitwise operations.
+Precedence: ! (not), & (and), | (or). Parentheses are supported.
+"""
+
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\s*(?:([&|!()])|([^\s&|!()]+))')
+
+
+class TagQueryError(Exception):
+    def __init__(self, message):
+        self.message = message
+
+
+def to_bitmap(ids) -> int:
+    bits = bytearray()
+    for i in ids:
+        if i >> 3 >= len(bits):
+            bits.extend(bytes((i >> 3) - len(bits) + 1))
+        bits[i >> 3] |= 1 << (i & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def from_bitmap(bitmap: int):
+    """ Generate ids in ascending order """
+    bits = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for byte_num, byte in enumerate(bits):
+        if byte:
+            for bit in range(8):
+                if byte >> bit & 1:
+                    yield byte_num * 8 + bit
+
+
+def tokenize(query: str) -> list:
+    tokens = []
+    pos = 0
+    query = query.strip()
+    while pos < len(query):
+        match = TOKEN_RE.match(query, pos)
+        if not match:
+            raise TagQueryError("Can't parse query at " + query[pos:])
+        tokens.append(match.group(1) or ('tag', match.group(2)))
+        pos = match.end()
+    return tokens
+
+
+def compile_query(query: str):
+    """ Return function which takes TagBitmaps and returns resulting bitmap """
+    tokens = tokenize(query)
+    pos = 0
+
+    def peek():
+        return tokens[pos] if pos < len(tokens) else None
+
+    def take():
+        nonlocal pos
+        pos += 1
+        return tokens[pos-1]
+
+    def expr():
+        left = term()
+        while peek() == '|':
+            take()
+            left = (lambda l, r: lambda b: l(b) | r(b))(left, term())
+        return left
+
+    def term():
+        left = factor()
+        while peek() == '&':
+            take()
+            left = (lambda l, r: lambda b: l(b) & r(b))(left, factor())
+        return left
+
+    def factor():
+        token = peek()
+        if token is None:
+            raise TagQueryError("Unexpected end of query")
+        take()
+        if token == '!':
+            operand = factor()
+            return lambda b: b.all & ~operand(b)
+        elif token == '(':
+            inner = expr()
+            if peek() != ')':
+                raise TagQueryError("Missing )")
+            take()
+            return inner
+        elif isinstance(token, tuple):
+            return lambda b: b.get(token[1])
+        else:
+            raise TagQueryError("Unexpected " + token)
+
+    if not tokens:
+        raise TagQueryError("Empty query")
+    compiled = expr()
+    if peek() is not None:
+        raise TagQueryError("Unexpected " + str(peek()))
+    return compiled
+
+
+class TagBitmaps:
+    """
+    Cache of tag -> bitmap of note ids. Rebuilt when DB schema changes (i.e.
+    on repopulation) or other connection commits (import, daemon, other dnev),
+    otherwise only notes reported via changed() are re-read.
+    """
+    def __init__(self):
+        self._bitmaps = {}
+        self.all = 0
+        self._version = None
+        self._changed = set()
+
+    def get(self, tag: str) -> int:
+        return self._bitmaps.get(tag, 0)
+
+    def changed(self, note_id=None):
+        """ Mark note's tags as changed. None means everything """
+        if note_id is None:
+            self._version = None
+        else:
+            self._changed.add(note_id)
+
+    def sync(self, conn):
+        """ Bring cache up to date with DB """
+        cur = conn.cursor()
+        # data_version changes only by commits of other connections
+        version = (cur.execute("PRAGMA schema_version").fetchone()[0],
+                   cur.execute("PRAGMA data_version").fetchone()[0])
+        if version != self._version:
+            self._build(cur)
+            self._version = version
+        elif self._changed:
+            for note_id in self._changed:
+                self._update_note(cur, note_id)
+        self._changed = set()
+
+    def _build(self, cur):
+        logger.debug("Building tag bitmaps")
+        notes = {}
+        cur.execute("""SELECT t.title, nt.note_id
+                       FROM note_tags AS nt
+                       JOIN tags AS t ON (t.id = nt.tag_id)
+                       JOIN notes AS n ON (n.id = nt.note_id)""")
+        for tag, note_id in cur.fetchall():
+            notes.setdefault(tag, []).append(note_id)
+        self._bitmaps = {tag: to_bitmap(ids) for tag, ids in notes.items()}
+        cur.execute("SELECT id FROM notes")
+        self.all = to_bitmap(row[0] for row in cur.fetchall())
+
+    def _update_note(self, cur, note_id):
+        bit = 1 << note_id
+        for tag in self._bitmaps:
+            self._bitmaps[tag] &= ~bit
+        self.all &= ~bit
+        if cur.execute("SELECT 1 FROM notes WHERE id = ?", (note_id,)).fetchone() is None:
+            return      # deleted
+        self.all |= bit
+        cur.execute("""SELECT t.title
+                       FROM note_tags AS nt
+                       JOIN tags AS t ON (t.id = nt.tag_id)
+                       WHERE nt.note_id = ?""", (note_id,))
+        for row in cur.fetchall():
+            self._bitmaps[row[0]] = self._bitmaps.get(row[0], 0) | bit
+
+    def query(self, conn, compiled) -> int:
+        self.sync(conn)
+        return compiled(self)
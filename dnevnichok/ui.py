@@ -1,15 +1,32 @@
 import curses
 import logging
+import textwrap
 
 from dnevnichok.aux import PagedItems
-from dnevnichok.core import ItemInterface
+from dnevnichok.config import config
+from dnevnichok.core import ItemInterface, NoteItem
 from dnevnichok.backend import GitCommandBackend
 from dnevnichok.events import event_hub
+from dnevnichok.preview import Previewer
 
 logger = logging.getLogger(__name__)
 
 backend = GitCommandBackend()
 
+SEARCH_DEBOUNCE = 150   # ms to wait for next key before running live search
+PREVIEW_POLL = 30       # ms to wait for key before checking if preview is rendered
+PREVIEW_MIN_WIDTH = 100 # preview is shown only on terminals at least that wide
+MOTIONS = {'j': 1, 'о': 1, curses.KEY_DOWN: 1,
+           'k': -1, 'л': -1, curses.KEY_UP: -1}
+
+
+def unget(c):
+    """ Put key back to input queue """
+    if type(c) is int:
+        curses.ungetch(c)
+    else:
+        curses.unget_wch(c)
+
 
 def polute(text, width, begin=True):
     """ Adds spaces to begin or end of line """
@@ -48,6 +65,7 @@ class ItemList:
             if i == self.cur_item: self.render_item(i, item, True)
             elif i >= self.Y: break
             else: self.render_item(i, item)
+        curses.doupdate()
 
     def get_rendered_view(self, view: tuple) -> str:
         return polute(view[0], self.width-16, False) + \
@@ -63,41 +81,48 @@ class ItemList:
             color = curses.color_pair(item.get_color())
         self.scr.addstr(position, 0, self.get_rendered_view(view), color)
 
-        self.scr.refresh()
+        self.scr.noutrefresh()  # screen is updated once by caller
 
     def switch_items(self, items, cur_item=0):
         """ Switch items e.g. on change directory """
         start_page = cur_item // self.Y + 1
         self.cur_item = cur_item - self.Y * (cur_item // self.Y)
-        self._items = PagedItems(items, self.Y, start_page)
+        if isinstance(items, PagedItems):   # already paged by manager
+            items.set_lines(self.Y)
+            items.set_page(start_page)
+            self._items = items
+        else:
+            self._items = PagedItems(items, self.Y, start_page)
         self.scr.clear()
         self.render()
 
     def move_highlight(self, to):
         self.render_item(self.cur_item, self._items[self.cur_item])
         self.render_item(to, self._items[to], True)
+        curses.doupdate()
 
     def move(self, i):
-        if i > 0 and self.cur_item < self.length-1:     # Down
-            self.move_highlight(self.cur_item+i)
-            self.cur_item += i
-        elif i > 0 and self.cur_item == self.length-1 and not self._items.has_next():
-            curses.beep()
-            return
-        elif i > 0 and self.cur_item == self.length-1 and self._items.has_next():
-            self.cur_item = 0
+        """ Move highlight by i lines, flipping pages if needed. Whatever
+        the distance, only the final position is rendered """
+        to, flipped = self.cur_item + i, False
+        while to >= len(self._items) and self._items.has_next():     # Down
+            to -= len(self._items)
             self._items.next()
-            self.render()
-        elif i < 0 and self.cur_item > 0:               # Up
-            self.move_highlight(self.cur_item+i)
-            self.cur_item += i  # i is negative
-        elif i < 0 and self.cur_item == 0 and not self._items.has_prev():
-            curses.beep()
-            return
-        elif i < 0 and self.cur_item == 0 and self._items.has_prev():
-            self.cur_item = self.length-1
+            flipped = True
+        while to < 0 and self._items.has_prev():                    # Up
             self._items.prev()
+            to += len(self._items)
+            flipped = True
+        if not 0 <= to < len(self._items):
+            curses.beep()
+            to = max(0, min(to, len(self._items)-1))
+
+        if flipped:
+            self.cur_item = to
             self.render()
+        elif to != self.cur_item:
+            self.move_highlight(to)
+            self.cur_item = to
 
     def move_to(self, i):
         if i < 0:
@@ -105,6 +130,30 @@ class ItemList:
         self.move_highlight(i)
         self.cur_item = i
 
+    def read_motion(self, c):
+        """ If `c` is motion key, swallow every motion key already waiting in
+        queue (e.g. auto-repeat of held j) and return their total shift, so it
+        can be rendered once. Return None for other keys. The first non-motion
+        key is left in queue, prompts and editors still get what user typed.
+        """
+        if c not in MOTIONS:
+            return None
+        shift = MOTIONS[c]
+        self.scr.nodelay(True)
+        try:
+            while True:
+                try:
+                    c = self.scr.get_wch()
+                except curses.error:    # queue is empty
+                    break
+                if c not in MOTIONS:
+                    unget(c)
+                    break
+                shift += MOTIONS[c]
+        finally:
+            self.scr.nodelay(False)
+        return shift
+
     def on_hightlight(self, func=None, item=None):
         """ With func argument it adds a callback. With item it sequentally run
         every added callback.
@@ -118,6 +167,17 @@ class ItemList:
     def get_current_item(self):
         return self._items[self.cur_item]
 
+    def get_items(self):
+        return self._items
+
+    def get_neighbours(self, item) -> list:
+        """ Items right after and before item on current page """
+        try:
+            position = self._items.index(item)
+        except ValueError:
+            return []
+        return [self._items[i] for i in (position+1, position-1) if 0 <= i < len(self._items)]
+
     def process_keypress(self, c):
         if type(c) is int:                  # Arrow-keys
             if c == curses.KEY_UP:
@@ -141,6 +201,45 @@ class ItemList:
         return True
 
 
+class PreviewPane:
+    """ Plain text of highlighted note. Text is rendered by Previewer in
+    background, pane shows it when it's ready """
+    def __init__(self, scr):
+        self.scr = scr
+        self.Y, self.X = self.scr.getmaxyx()
+        self.previewer = Previewer()
+        self.item = None
+
+    def show_item(self, item, neighbours=()):
+        self.item = item if isinstance(item, NoteItem) else None
+        notes = [n for n in [item] + list(neighbours) if isinstance(n, NoteItem)]
+        self.previewer.request([note.full_path for note in notes])
+        self.render()
+
+    def poll(self):
+        """ Render highlighted note if it was just rendered in background """
+        if self.item and self.item.full_path in self.previewer.finished():
+            self.render()
+
+    def pending(self) -> bool:
+        return self.previewer.pending()
+
+    def render(self):
+        self.scr.erase()
+        text = self.previewer.get(self.item.full_path) if self.item else ''
+        if text is None:
+            text = '...'
+        lines = []
+        for paragraph in text.splitlines():
+            lines.extend(textwrap.wrap(paragraph, self.X - 1) or [''])
+            if len(lines) >= self.Y:
+                break
+        for i, line in enumerate(lines[:self.Y]):
+            self.scr.addstr(i, 0, line)
+        self.scr.noutrefresh()
+        curses.doupdate()
+
+
 class InfoBar:
     def __init__(self, scr):
         self.scr = scr
@@ -175,6 +274,7 @@ class InfoBar:
 
     def input(self, prompt=''):
         self.print(prompt)
+        self.scr.timeout(-1)    # main loop may be polling preview
         curses.echo()
         self.scr.attrset(curses.color_pair(20))
         input = self.scr.getstr(self.Y, len(prompt), 40).decode()
@@ -182,6 +282,58 @@ class InfoBar:
         self.clear()
         return input
 
+    def has_pending_input(self) -> bool:
+        """ Check without blocking if user already pressed something """
+        self.scr.nodelay(True)
+        try:
+            c = self.scr.get_wch()
+        except curses.error:
+            return False
+        finally:
+            self.scr.nodelay(False)
+        unget(c)
+        return True
+
+    def live_input(self, prompt, on_change, debounce=SEARCH_DEBOUNCE):
+        """ Like input, but calls on_change(text, cancelled) every time text
+        is changed and user stopped typing for `debounce` ms.
+        `cancelled` tells whether new key is already waiting.
+        Return None if input was cancelled with Esc
+        """
+        text = ''
+        self.scr.timeout(-1)
+        curses.curs_set(1)
+        try:
+            while True:
+                self.print(prompt + text)
+                self.scr.move(self.Y, min(len(prompt + text), self.width-1))
+                c = self.scr.get_wch()
+                if c in ('\n', '\r', curses.KEY_ENTER):
+                    break
+                elif c == '\x1b':
+                    text = None
+                    break
+                elif c in (curses.KEY_BACKSPACE, '\x7f', '\b'):
+                    text = text[:-1]
+                elif type(c) is str and c.isprintable():
+                    text += c
+                else:
+                    continue
+
+                self.scr.timeout(debounce)
+                try:
+                    next_c = self.scr.get_wch()
+                except curses.error:    # user stopped typing
+                    on_change(text, self.has_pending_input)
+                else:
+                    unget(next_c)
+                finally:
+                    self.scr.timeout(-1)
+        finally:
+            curses.curs_set(0)
+            self.clear()
+        return text
+
     def clear(self):
         self.scr.move(self.Y, 0)
         self.scr.clrtoeol()
@@ -209,10 +361,18 @@ class MainWindow:
         curses.init_pair(20, 15, 234)   # bar
         self.bar = InfoBar(scr)
         stdscr_y, stdscr_x = self.stdscr.getmaxyx()
-        subwin = self.stdscr.subwin(stdscr_y - 3, stdscr_x, 0, 0)
+        show_preview = config.getboolean('UI', 'preview', True) and \
+            stdscr_x >= PREVIEW_MIN_WIDTH
+        left_width = stdscr_x // 2 if show_preview else stdscr_x
+        subwin = self.stdscr.subwin(stdscr_y - 3, left_width, 0, 0)
 
         self.left_pane = ItemList(subwin)
         self.left_pane.on_hightlight(func=self.bar.render_item_info)
+        self.preview = None
+        if show_preview:
+            self.preview = PreviewPane(self.stdscr.subwin(stdscr_y - 3, stdscr_x - left_width - 2,
+                                                          0, left_width + 2))
+            self.left_pane.on_hightlight(func=self.show_preview)
 
         event_hub.register('print', self.print)
         event_hub.register('key-press', self.left_pane.process_keypress)
@@ -221,15 +381,38 @@ class MainWindow:
     def print(self, text):
         self.bar.print(text)
 
+    def show_preview(self, item):
+        self.preview.show_item(item, self.left_pane.get_neighbours(item))
+
+    def poll_preview(self):
+        if self.preview:
+            self.preview.poll()
+
+    def input_timeout(self) -> int:
+        """ How long main loop may block waiting for key (-1 is forever) """
+        return PREVIEW_POLL if self.preview and self.preview.pending() else -1
+
     def input(self, prompt=None):
         return self.bar.input(prompt)
 
+    def live_input(self, prompt, on_change):
+        return self.bar.live_input(prompt, on_change)
+
     def clear_bar(self):
         self.bar.clear()
 
+    def read_motion(self, c):
+        return self.left_pane.read_motion(c)
+
+    def move(self, shift):
+        self.left_pane.move(shift)
+
     def show_items(self, items, cur_item=0):
         self.left_pane.switch_items(items, cur_item)
         self.left_pane.render()
 
     def get_current_item(self):
         return self.left_pane.get_current_item()
+
+    def get_items(self):
+        return self.left_pane.get_items()